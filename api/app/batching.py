@@ -0,0 +1,275 @@
+import time
+import asyncio
+from collections import deque
+
+# --- бакеты по длине в токенах (с [CLS]/[SEP]) ---
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+# окно (сек), по которому считаем частоту поступления запросов
+RATE_WINDOW_S = 1.0
+
+# --- классы приоритета ---
+# пачка набирается сначала из interactive (поиск на витрине), остаток — из bulk (переиндексация)
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+def bucket_for(length, buckets=LENGTH_BUCKETS):
+    """Наименьший бакет, в который помещается последовательность."""
+    for b in buckets:
+        if length <= b:
+            return b
+    return buckets[-1]
+
+
+class QueueFull(Exception):
+    """В очереди нет места: запрос нужно отклонить или обслужить без модели."""
+
+
+class DeadlineExceeded(Exception):
+    """Строка не дождалась пачки до дедлайна и выброшена из очереди."""
+
+
+class Row:
+    """Одна строка батча: текст, его токенизация и future для ответа."""
+    __slots__ = (
+        "text", "ids", "offsets", "length", "future", "enqueued_at", "deadline", "queue_wait", "stages",
+        "lane", "waiters",
+    )
+
+    def __init__(self, text, ids, offsets, future, deadline=None, lane=INTERACTIVE):
+        self.text = text
+        self.ids = ids
+        self.offsets = offsets
+        self.length = len(ids)
+        self.future = future
+        self.enqueued_at = 0.0
+        # time.monotonic(), после которого результат никому не нужен
+        self.deadline = deadline
+        # разбивка времени для лога медленных запросов: ожидание в очереди и стадии пачки
+        self.queue_wait = 0.0
+        self.stages = None
+        self.lane = lane
+        # сколько запросов ждут результат строки (схлопнутые запросы ждут одну строку)
+        self.waiters = 0
+
+
+class BatchScheduler:
+    """
+    Динамический батчинг вместо фиксированных BATCH_SIZE / MAX_WAIT_MS.
+
+    - строки раскладываются по бакетам длины, пачка собирается из одного бакета,
+      поэтому короткие запросы не платят за паддинг до длинного;
+    - размер пачки ограничен бюджетом токенов (строки × длина бакета);
+    - окно ожидания считается из наблюдаемой частоты запросов: при низкой нагрузке
+      ждать бессмысленно (min_wait), при высокой — ждём, пока пачка успеет заполниться,
+      но не дольше max_wait;
+    - очередь ограничена max_pending строками, просроченные строки выбрасываются
+      до session.run;
+    - у каждого класса приоритета свои бакеты: бакет пачки выбирается по interactive,
+      пачка добирается строками bulk того же бакета; bulk занимает не больше max_bulk строк,
+      чтобы у interactive всегда оставалось место.
+    """
+
+    def __init__(
+        self,
+        token_budget=4096,
+        max_batch=128,
+        min_wait_ms=1,
+        max_wait_ms=50,
+        buckets=LENGTH_BUCKETS,
+        max_pending=None,
+        on_expired=None,
+        max_bulk=None,
+    ):
+        self.token_budget = token_budget
+        self.max_pending = max_pending
+        self.max_bulk = max_bulk
+        self.on_expired = on_expired
+        self.max_batch = max_batch
+        self.min_wait = min_wait_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self.buckets = tuple(buckets)
+        self._queues = {lane: {b: deque() for b in self.buckets} for lane in LANES}
+        self._sizes = dict.fromkeys(LANES, 0)
+        self._size = 0
+        self._event = asyncio.Event()
+        self._arrivals = deque()  # (timestamp, число строк)
+        self._arrived = 0
+
+    def __len__(self):
+        return self._size
+
+    def depth(self, lane):
+        """Строк в очереди класса приоритета."""
+        return self._sizes[lane]
+
+    def capacity(self, bucket):
+        """Сколько строк помещается в пачку данного бакета."""
+        return max(1, min(self.max_batch, self.token_budget // bucket))
+
+    def max_tokens(self):
+        """Наибольший объём пачки (строк × длина бакета)."""
+        return max(self.capacity(b) * b for b in self.buckets)
+
+    def batch_sizes(self, bucket):
+        """Числа строк пачки бакета: степени двойки до вместимости и сама вместимость."""
+        cap = self.capacity(bucket)
+        sizes = {cap}
+        n = 1
+        while n < cap:
+            sizes.add(n)
+            n *= 2
+        return sorted(sizes)
+
+    def shapes(self, max_len=None):
+        """
+        Формы (строк, длина) для прогрева: по каждому бакету — степени двойки до вместимости
+        и сама вместимость. Живые пачки до них не добиваются, прогрев лишь заранее
+        инициализирует аллокатор и ядра ORT.
+        """
+        out = []
+        for bucket in self.buckets:
+            if max_len is not None and bucket > max_len:
+                break
+            out.extend((n, bucket) for n in self.batch_sizes(bucket))
+        return out
+
+    # --------------------
+    # частота поступления
+    # --------------------
+    def _observe_arrival(self, now, n):
+        self._arrivals.append((now, n))
+        self._arrived += n
+        self._trim_arrivals(now)
+
+    def _trim_arrivals(self, now):
+        while self._arrivals and now - self._arrivals[0][0] > RATE_WINDOW_S:
+            _, n = self._arrivals.popleft()
+            self._arrived -= n
+
+    def arrival_rate(self):
+        """Строк в секунду за последнее окно."""
+        self._trim_arrivals(time.monotonic())
+        return self._arrived / RATE_WINDOW_S
+
+    def wait_window(self, missing):
+        """Сколько ждать добора `missing` строк при текущей частоте."""
+        rate = self.arrival_rate()
+        if missing <= 0 or rate * self.max_wait <= 1.0:
+            # за максимальное окно не придёт даже одного запроса — не ждём
+            return self.min_wait
+        return min(self.max_wait, max(self.min_wait, missing / rate))
+
+    # --------------------
+    # очередь
+    # --------------------
+    def has_room(self, n=1, lane=INTERACTIVE):
+        if lane == BULK and self.max_bulk is not None and self._sizes[BULK] + n > self.max_bulk:
+            return False
+        return self.max_pending is None or self._size + n <= self.max_pending
+
+    def submit(self, rows):
+        for lane in LANES:
+            n = sum(1 for row in rows if row.lane == lane)
+            if n and not self.has_room(n, lane):
+                raise QueueFull(f"{lane} queue is full ({self._size}/{self.max_pending})")
+        now = time.monotonic()
+        for row in rows:
+            row.enqueued_at = now
+            self._queues[row.lane][bucket_for(row.length, self.buckets)].append(row)
+            self._sizes[row.lane] += 1
+        self._size += len(rows)
+        self._observe_arrival(now, len(rows))
+        self._event.set()
+
+    def discard(self, row):
+        """Убирает строку из очереди до сборки пачки. False — строка уже в пачке."""
+        try:
+            self._queues[row.lane][bucket_for(row.length, self.buckets)].remove(row)
+        except ValueError:
+            return False
+        self._sizes[row.lane] -= 1
+        self._size -= 1
+        return True
+
+    def promote(self, row):
+        """
+        Переводит строку bulk, ещё стоящую в очереди, в interactive — к ней присоединился
+        интерактивный запрос с тем же текстом. Место в очереди (enqueued_at) сохраняется.
+        """
+        if row.lane != BULK or not self.discard(row):
+            return
+        row.lane = INTERACTIVE
+        q = self._queues[INTERACTIVE][bucket_for(row.length, self.buckets)]
+        # очереди упорядочены по enqueued_at — вставляем на своё место
+        i = len(q)
+        while i > 0 and q[i - 1].enqueued_at > row.enqueued_at:
+            i -= 1
+        q.insert(i, row)
+        self._sizes[INTERACTIVE] += 1
+        self._size += 1
+        self._event.set()
+
+    def _pick(self):
+        """(класс, бакет) следующей пачки: самый старый бакет interactive, если он не пуст."""
+        lane = INTERACTIVE if self._sizes[INTERACTIVE] else BULK
+        heads = [(q[0].enqueued_at, b) for b, q in self._queues[lane].items() if q]
+        return lane, min(heads)[1]
+
+    def _pending(self, bucket):
+        return sum(len(self._queues[lane][bucket]) for lane in LANES)
+
+    async def _wait_arrival(self, timeout):
+        self._event.clear()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _expire(self, row):
+        if not row.future.done():
+            row.future.set_exception(DeadlineExceeded())
+        if self.on_expired is not None:
+            self.on_expired(row)
+
+    async def next_batch(self):
+        """Ждёт и возвращает (бакет, строки) следующей пачки."""
+        while True:
+            while self._size == 0:
+                self._event.clear()
+                await self._event.wait()
+
+            lane, bucket = self._pick()
+            cap = self.capacity(bucket)
+            head = self._queues[lane][bucket][0]
+            deadline = head.enqueued_at + self.wait_window(cap - self._pending(bucket))
+
+            preempted = False
+            while self._pending(bucket) < cap:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                await self._wait_arrival(timeout)
+                if lane == BULK and self._sizes[INTERACTIVE]:
+                    # пришёл интерактивный запрос — пачка собирается заново, уже под него
+                    preempted = True
+                    break
+            if preempted:
+                continue
+
+            # сначала interactive, остаток — bulk; просроченные строки в пачку не попадают
+            rows, now = [], time.monotonic()
+            for lane in LANES:
+                q = self._queues[lane][bucket]
+                while q and len(rows) < cap:
+                    row = q.popleft()
+                    self._size -= 1
+                    self._sizes[lane] -= 1
+                    if row.deadline is not None and row.deadline < now:
+                        self._expire(row)
+                    else:
+                        rows.append(row)
+            if rows:
+                return bucket, rows
@@ -0,0 +1,318 @@
+import os
+import time
+import fcntl
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+from .text import key_hash
+from .workers import open_shared, pid_alive
+
+
+class ResultCache:
+    """
+    LRU-кэш результатов с TTL. Ключ — каноническая форма запроса (text.canonicalize).
+    Работает в потоке event loop, блокировки не нужны.
+    """
+
+    def __init__(self, maxsize=100_000, ttl_s=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl_s
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        # поколение записей: растёт при clear()
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def attach(self):
+        """После fork: кэш в памяти процесса, переоткрывать нечего."""
+
+    def get(self, key):
+        """Значение из кэша или None."""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation=None):
+        """generation — поколение, при котором начат расчёт; после clear() такой результат не кладётся."""
+        if not self.enabled or (generation is not None and generation != self.generation):
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Инвалидация, например, при перезагрузке модели."""
+        self._data.clear()
+        self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# --------------------
+# общий кэш для воркеров gunicorn
+# --------------------
+_MAGIC = b"NERCACHE"
+_HEADER = struct.Struct("<8sIIII")          # magic, version, nslots, slot_size, generation
+_HEADER_SIZE = 64
+_WORKER = struct.Struct("<QQQQQ")          # pid, hits, misses, cross_hits, puts
+_MAX_WORKERS = 64
+_SLOT = struct.Struct("<IIQdIHH")           # seq, generation, hash, expires_at, writer_pid, klen, vlen
+_SLOT_DTYPE = np.dtype([
+    ("seq", "<u4"), ("generation", "<u4"), ("hash", "<u8"), ("expires_at", "<f8"),
+    ("writer_pid", "<u4"), ("klen", "<u2"), ("vlen", "<u2"),
+])
+_ENTITY = struct.Struct("<HHB")             # start, end, label_id
+_WAYS = 4
+
+
+class SharedResultCache:
+    """
+    Кэш результатов в общей памяти (mmap файла в /dev/shm), общий для всех
+    воркеров на хосте: результат, посчитанный воркером 1, — попадание для воркера 3.
+
+    - фиксированный размер: nslots слотов по slot_size байт;
+    - 4-входовая ассоциативная таблица, при заполнении набора вытесняется самая старая запись;
+    - чтение без блокировок (seqlock на слот), запись под fcntl-блокировкой диапазона набора;
+    - clear() увеличивает поколение в заголовке, старые записи становятся промахами;
+    - у каждого процесса своя строка счётчиков, stats() суммирует все.
+    """
+
+    def __init__(self, path, labels, nslots=65536, slot_size=256, ttl_s=3600):
+        self.path = path
+        self.labels = list(labels)
+        self._label_ids = {l: i for i, l in enumerate(self.labels)}
+        self.ttl = ttl_s
+        self.nslots = nslots - nslots % _WAYS
+        self.slot_size = slot_size
+        self.maxsize = self.nslots
+        self._nsets = self.nslots // _WAYS
+        self._slots_off = _HEADER_SIZE + _MAX_WORKERS * _WORKER.size
+        size = self._slots_off + self.nslots * slot_size
+
+        self._fd, self._mm = open_shared(
+            path, size, valid=self._valid_header,
+            init=lambda mm: _HEADER.pack_into(mm, 0, _MAGIC, 1, self.nslots, slot_size, 0),
+        )
+        self.attach()
+
+    def attach(self):
+        """
+        Регистрирует текущий процесс (строка счётчиков, pid писателя).
+        Вызывается после fork: mmap наследуется, а pid у воркера свой.
+        """
+        if getattr(self, "_pid", None) == os.getpid():
+            return
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_SIZE, 0, os.SEEK_SET)
+        try:
+            self._pid = os.getpid()
+            self._row = self._claim_row()
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_SIZE, 0, os.SEEK_SET)
+
+    def _valid_header(self, fd):
+        raw = os.pread(fd, _HEADER.size, 0)
+        if len(raw) < _HEADER.size:
+            return False
+        magic, _, nslots, slot_size, _ = _HEADER.unpack(raw)
+        return magic == _MAGIC and nslots == self.nslots and slot_size == self.slot_size
+
+    def _claim_row(self):
+        # строка счётчиков свободна, если её процесс уже завершился
+        for i in range(_MAX_WORKERS):
+            off = _HEADER_SIZE + i * _WORKER.size
+            pid = _WORKER.unpack_from(self._mm, off)[0]
+            if pid == self._pid or pid == 0 or not pid_alive(pid):
+                _WORKER.pack_into(self._mm, off, self._pid, 0, 0, 0, 0)
+                return off
+        return None
+
+    def _count(self, field):
+        if self._row is None:
+            return
+        off = self._row + 8 * field
+        value = struct.unpack_from("<Q", self._mm, off)[0]
+        struct.pack_into("<Q", self._mm, off, value + 1)
+
+    @property
+    def enabled(self):
+        return self.nslots > 0
+
+    def __len__(self):
+        # заголовки слотов как strided-массив поверх mmap, без цикла по слотам
+        slots = np.ndarray(
+            (self.nslots,), dtype=_SLOT_DTYPE, buffer=self._mm,
+            offset=self._slots_off, strides=(self.slot_size,),
+        )
+        live = (
+            (slots["seq"] > 0) & (slots["seq"] % 2 == 0)
+            & (slots["generation"] == self._generation())
+            & (slots["expires_at"] >= time.time())
+        )
+        return int(live.sum())
+
+    def _totals(self):
+        rows = np.ndarray(
+            (_MAX_WORKERS, 5), dtype="<u8", buffer=self._mm, offset=_HEADER_SIZE,
+        )
+        return rows[:, 1:].sum(axis=0).tolist()
+
+    @property
+    def hits(self):
+        return self._totals()[0]
+
+    @property
+    def misses(self):
+        return self._totals()[1]
+
+    def _generation(self):
+        return _HEADER.unpack_from(self._mm, 0)[4]
+
+    @property
+    def generation(self):
+        """Текущее поколение записей, общее для всех воркеров."""
+        return self._generation()
+
+    def _slot_off(self, slot):
+        return self._slots_off + slot * self.slot_size
+
+    # --------------------
+    # сериализация
+    # --------------------
+    def _encode(self, entities):
+        return b"".join(
+            _ENTITY.pack(e["start_index"], e["end_index"], self._label_ids[e["entity"]])
+            for e in entities
+        )
+
+    def _decode(self, raw):
+        return [
+            {"start_index": start, "end_index": end, "entity": self.labels[label_id]}
+            for start, end, label_id in _ENTITY.iter_unpack(raw)
+        ]
+
+    # --------------------
+    # чтение / запись
+    # --------------------
+    def get(self, key):
+        """Значение из кэша или None."""
+        key_bytes = key.encode("utf-8")
+        h = key_hash(key_bytes)
+        first = (h % self._nsets) * _WAYS
+        gen, now = self._generation(), time.time()
+        for slot in range(first, first + _WAYS):
+            off = self._slot_off(slot)
+            seq, sgen, shash, expires_at, writer, klen, vlen = _SLOT.unpack_from(self._mm, off)
+            if shash != h or seq % 2 or sgen != gen or expires_at < now:
+                continue
+            body = self._mm[off + _SLOT.size:off + _SLOT.size + klen + vlen]
+            # слот переписали во время чтения — считаем промахом
+            if struct.unpack_from("<I", self._mm, off)[0] != seq:
+                break
+            if body[:klen] != key_bytes:
+                continue
+            self._count(1)
+            if writer != self._pid:
+                self._count(3)
+            return self._decode(body[klen:])
+        self._count(2)
+        return None
+
+    def put(self, key, value, generation=None):
+        """generation — поколение, при котором начат расчёт: результат воркера со старой моделью
+        после clear() в другом процессе не попадает в новое поколение."""
+        key_bytes = key.encode("utf-8")
+        payload = self._encode(value)
+        if _SLOT.size + len(key_bytes) + len(payload) > self.slot_size:
+            return  # слишком длинный запрос для слота
+        h = key_hash(key_bytes)
+        first = (h % self._nsets) * _WAYS
+        set_off = self._slot_off(first)
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _WAYS * self.slot_size, set_off, os.SEEK_SET)
+        try:
+            gen, now = self._generation(), time.time()
+            if generation is not None and generation != gen:
+                return
+            target, oldest = None, None
+            for slot in range(first, first + _WAYS):
+                off = self._slot_off(slot)
+                seq, sgen, shash, expires_at, *_ = _SLOT.unpack_from(self._mm, off)
+                if shash == h or sgen != gen or expires_at < now or seq % 2:
+                    target = off
+                    break
+                if oldest is None or expires_at < oldest[0]:
+                    oldest = (expires_at, off)
+            if target is None:
+                target = oldest[1]
+
+            seq = _SLOT.unpack_from(self._mm, target)[0]
+            # нечётный seq — запись в процессе, читатели пропускают слот
+            struct.pack_into("<I", self._mm, target, seq | 1)
+            body = target + _SLOT.size
+            self._mm[body:body + len(key_bytes) + len(payload)] = key_bytes + payload
+            _SLOT.pack_into(
+                self._mm, target, (seq | 1) + 1, gen, h, now + self.ttl,
+                self._pid, len(key_bytes), len(payload),
+            )
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _WAYS * self.slot_size, set_off, os.SEEK_SET)
+        self._count(4)
+
+    def clear(self):
+        """Инвалидация во всех воркерах: новое поколение записей."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_SIZE, 0, os.SEEK_SET)
+        try:
+            magic, version, nslots, slot_size, gen = _HEADER.unpack_from(self._mm, 0)
+            _HEADER.pack_into(self._mm, 0, magic, version, nslots, slot_size, (gen + 1) & 0xFFFFFFFF)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_SIZE, 0, os.SEEK_SET)
+
+    def stats(self):
+        workers = []
+        for i in range(_MAX_WORKERS):
+            pid, hits, misses, cross, puts = _WORKER.unpack_from(self._mm, _HEADER_SIZE + i * _WORKER.size)
+            if pid:
+                workers.append({"pid": pid, "hits": hits, "misses": misses,
+                                "cross_worker_hits": cross, "puts": puts})
+        hits = sum(w["hits"] for w in workers)
+        misses = sum(w["misses"] for w in workers)
+        cross = sum(w["cross_worker_hits"] for w in workers)
+        total = hits + misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "cross_worker_hits": cross,
+            "cross_worker_hit_rate": cross / total if total else 0.0,
+            "workers": workers,
+        }
+
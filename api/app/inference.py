@@ -0,0 +1,274 @@
+import time
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import onnxruntime as ort
+import onnx
+from onnx import numpy_helper
+
+from .metrics import STAGE_LATENCY, BATCH_ROWS, BATCH_TOKENS
+
+LABELS = [
+    "O",
+    "B-TYPE", "I-TYPE",
+    "B-BRAND", "I-BRAND",
+    "B-VOLUME", "I-VOLUME",
+    "B-PERCENT", "I-PERCENT"
+]
+LABEL_IDS = {label: i for i, label in enumerate(LABELS)}
+
+
+# инициализаторы не больше этого остаются в графе: мелкие константы (оси, формы)
+# ORT читает при выводе форм ещё до подстановки add_initializer
+SHARED_INITIALIZER_BYTES = 1024
+TENSOR_DATA_FIELDS = (
+    "raw_data", "float_data", "int32_data", "int64_data", "double_data", "uint64_data", "string_data",
+)
+
+
+def load_model(model_path, share_weights=True):
+    """
+    Читает модель один раз (в master gunicorn до fork). Возвращает (модель для сессий, веса).
+
+    С share_weights крупные веса достаются в numpy-массивы и вырезаются из графа: после fork
+    воркеры видят те же страницы памяти (copy-on-write), сессии получают веса через
+    add_initializer и собираются из графа без весов — ни master, ни воркер не держат
+    полную копию модели. Без share_weights возвращается путь, каждая сессия читает файл сама.
+    """
+    if not share_weights:
+        return model_path, None
+    model = onnx.load(model_path)
+    weights = {}
+    for init in model.graph.initializer:
+        if init.ByteSize() > SHARED_INITIALIZER_BYTES:
+            weights[init.name] = numpy_helper.to_array(init)
+            for field in TENSOR_DATA_FIELDS:
+                init.ClearField(field)
+    return model.SerializeToString(), weights
+
+
+def create_session(model, threads=1, weights=None):
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = threads
+    so.inter_op_num_threads = 1
+    values = []
+    if weights:
+        for name, array in weights.items():
+            value = ort.OrtValue.ortvalue_from_numpy(array)
+            so.add_initializer(name, value)
+            values.append(value)
+        # prepacking копирует веса MatMul в каждую сессию — отключаем, чтобы память была общей
+        so.add_session_config_entry("session.disable_prepacking", "1")
+    session = ort.InferenceSession(
+        model,
+        sess_options=so,
+        providers=["CPUExecutionProvider"]
+    )
+    # OrtValue ссылаются на общие массивы и должны жить не меньше сессии
+    return session, values
+
+
+class BatchBuffers:
+    """
+    Входы и выход пачки, выделенные один раз на сессию под максимальный объём пачки.
+    view(n, seq_len) — непрерывные срезы плоских массивов, без новых аллокаций;
+    через IOBinding ORT читает входы и пишет выход прямо в эти массивы.
+    Выход — логиты или, у сервингового графа (train/fuse_outputs.py), готовые id меток.
+    """
+
+    def __init__(self, session, tokens, num_labels=len(LABELS)):
+        output_names = [o.name for o in session.get_outputs()]
+        # у сервингового графа привязывается только label_ids: confidence тогда не считается
+        self.fused = "label_ids" in output_names
+        self.output_name = "label_ids" if self.fused else output_names[0]
+        self.output_width = 1 if self.fused else num_labels
+        self.input_names = [i.name for i in session.get_inputs()]
+        self.binding = session.io_binding()
+        self._allocate(tokens)
+
+    def _allocate(self, tokens):
+        self.tokens = tokens
+        self.input_ids = np.empty(tokens, dtype=np.int64)
+        self.attention_mask = np.empty(tokens, dtype=np.int64)
+        self.token_type_ids = np.zeros(tokens, dtype=np.int64)
+        self.offsets = np.empty((tokens, 2), dtype=np.int64)
+        self.output = np.empty(
+            tokens * self.output_width, dtype=np.int64 if self.fused else np.float32
+        )
+
+    def view(self, n, seq_len):
+        size = n * seq_len
+        if size > self.tokens:
+            # пачка больше расчётной (другой бюджет токенов) — растим буферы
+            self._allocate(size)
+        return (
+            self.input_ids[:size].reshape(n, seq_len),
+            self.attention_mask[:size].reshape(n, seq_len),
+            self.token_type_ids[:size].reshape(n, seq_len),
+            self.offsets[:size].reshape(n, seq_len, 2),
+        )
+
+    def bind(self, tokens, n, seq_len):
+        """
+        Привязывает входы (срезы буферов) и выход к IOBinding.
+        OrtValue из numpy на CPU ссылается на память массива, данные не копируются.
+        Возвращает срез выхода: id меток (n, seq_len) или логиты (n, seq_len, метки).
+        """
+        for name in self.input_names:
+            self.binding.bind_ortvalue_input(name, ort.OrtValue.ortvalue_from_numpy(tokens[name]))
+        shape = (n, seq_len) if self.fused else (n, seq_len, self.output_width)
+        output = self.output[:n * seq_len * self.output_width].reshape(shape)
+        self.binding.bind_ortvalue_output(self.output_name, ort.OrtValue.ortvalue_from_numpy(output))
+        return output
+
+
+class SessionPool:
+    """
+    Пул InferenceSession, каждая со своим бюджетом потоков и буферами входов.
+    Инференс выполняется в отдельном executor, event loop не блокируется;
+    одновременно в работе может быть до `size` пачек.
+    Создаётся в каждом воркере после fork; `model` — путь или байты модели,
+    `batch_tokens` — наибольший объём пачки (строк × длина) для буферов.
+    """
+
+    def __init__(self, model, size=1, threads_per_session=1, weights=None, batch_tokens=4096):
+        self.size = size
+        self.sessions = []
+        self._values = []
+        for _ in range(size):
+            session, values = create_session(model, threads_per_session, weights)
+            self.sessions.append(session)
+            self._values.append(values)
+        self._slots = [(s, BatchBuffers(s, batch_tokens)) for s in self.sessions]
+        self._free = queue.SimpleQueue()
+        for slot in self._slots:
+            self._free.put(slot)
+        # потоков executor ровно столько же, сколько сессий — get() не блокируется
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="ort")
+
+    def _call(self, fn, args):
+        slot = self._free.get()
+        try:
+            return fn(*slot, *args)
+        finally:
+            self._free.put(slot)
+
+    async def run(self, fn, *args):
+        """Выполняет fn(session, buffers, *args) на свободной сессии в executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._call, fn, args)
+
+    def close(self):
+        """Отпускает пул после подмены: уже отданные пачки досчитываются, новых не принимает."""
+        self.executor.shutdown(wait=False)
+
+    async def warmup(self, shapes):
+        """Прогревает все сессии пула параллельно, каждую — на всех формах пачек."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self.executor, warmup_session, session, buffers, shapes)
+            for session, buffers in self._slots
+        ))
+
+
+def warmup_session(session, buffers, shapes):
+    """
+    Прогон пустышек всех форм (строк, длина) через те же буферы и IOBinding,
+    что и у настоящих пачек: аллокатор и ядра ORT инициализируются заранее.
+    """
+    for batch, seq_len in shapes:
+        # [CLS] x ... x [SEP] — содержимое не важно, важна форма
+        input_ids, attention_mask, token_type_ids, _ = buffers.view(batch, seq_len)
+        input_ids.fill(1)
+        attention_mask.fill(1)
+        tokens = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": token_type_ids,
+        }
+        buffers.bind(tokens, batch, seq_len)
+        session.run_with_iobinding(buffers.binding)
+
+
+def predict_rows(session, buffers, rows, pad_id=0):
+    t0 = time.perf_counter()
+    # паддинг до самой длинной строки пачки (строки уже из одного бакета)
+    seq_len = max(r.length for r in rows)
+    input_ids, attention_mask, token_type_ids, offsets = buffers.view(len(rows), seq_len)
+    input_ids.fill(pad_id)
+    attention_mask.fill(0)
+    offsets.fill(0)
+    for i, r in enumerate(rows):
+        input_ids[i, :r.length] = r.ids
+        attention_mask[i, :r.length] = 1
+        offsets[i, :r.length] = r.offsets
+
+    tokens = {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "token_type_ids": token_type_ids,
+    }
+    output = buffers.bind(tokens, len(rows), seq_len)
+
+    t1 = time.perf_counter()
+    session.run_with_iobinding(buffers.binding)
+    t2 = time.perf_counter()
+    pred_ids_batch = output if buffers.fused else np.argmax(output, axis=-1)
+    results = decode_entities(pred_ids_batch, offsets)
+    t3 = time.perf_counter()
+
+    STAGE_LATENCY.labels("pack").observe(t1 - t0)
+    STAGE_LATENCY.labels("inference").observe(t2 - t1)
+    STAGE_LATENCY.labels("postprocess").observe(t3 - t2)
+    # общий для строк пачки словарь, resolved_at дописывает event loop
+    stages = {"pack": t1 - t0, "inference": t2 - t1, "postprocess": t3 - t2, "batch_rows": len(rows)}
+    for r in rows:
+        r.stages = stages
+    BATCH_ROWS.observe(len(rows))
+    BATCH_TOKENS.observe(len(rows) * seq_len)
+    return results
+
+
+def decode_entities(pred_ids, offsets):
+    """
+    Метки и offsets всей пачки → сущности по каждой строке, без цикла по токенам.
+
+    Токены с пустым спаном (спецтокены, паддинг) отбрасываются маской, соседние
+    токены (конец предыдущего == начало следующего) склеиваются в одну сущность
+    с меткой первого токена.
+    """
+    starts, ends = offsets[..., 0], offsets[..., 1]
+    rows, cols = np.nonzero(starts != ends)
+    s, e, lab = starts[rows, cols], ends[rows, cols], pred_ids[rows, cols]
+
+    # начало новой сущности: новая строка или разрыв между токенами
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (s[1:] != e[:-1])
+    first = np.flatnonzero(first)
+    last = np.append(first[1:], len(rows))[:len(first)] - 1
+
+    ent_rows = rows[first]
+    ent_start = s[first].tolist()
+    ent_end = e[last].tolist()
+    ent_label = lab[first].tolist()
+    bounds = np.searchsorted(ent_rows, np.arange(len(pred_ids) + 1)).tolist()
+
+    # JSON-ответ собирается только здесь, по одному списку на строку
+    return [
+        [
+            {"start_index": ent_start[k], "end_index": ent_end[k], "entity": LABELS[ent_label[k]]}
+            for k in range(bounds[i], bounds[i + 1])
+        ]
+        for i in range(len(pred_ids))
+    ]
+
+
+def compact(entities):
+    """Сущности → параллельные массивы начал, концов и id меток (индексы в LABELS)."""
+    return {
+        "starts": [e["start_index"] for e in entities],
+        "ends": [e["end_index"] for e in entities],
+        "labels": [LABEL_IDS[e["entity"]] for e in entities],
+    }
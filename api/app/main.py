@@ -1,28 +1,56 @@
 import os
+import hmac
 import time
-import logging
+import signal
+import resource
 import requests
-import numpy as np
-import onnxruntime as ort
 import asyncio
-from fastapi import FastAPI, HTTPException, Request
+from functools import partial
+from typing import List, Literal, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from transformers import AutoTokenizer
-from starlette.middleware.base import BaseHTTPMiddleware
+
+from .batching import BatchScheduler, Row, QueueFull, DeadlineExceeded, LANES, INTERACTIVE, BULK
+from .inference import LABELS, SessionPool, compact, load_model, predict_rows
+from .cache import ResultCache, SharedResultCache
+from .text import canonicalize, restore_offsets
+from .reqlog import RequestLog
+from .stream import DuplexStreamingResponse, iter_lines, parse_line, ndjson_line
+from .rules import FastLane, RuleTagger, load_brands
+from .profiler import sample_stacks
+from .tokenization import FastTokenizer, WordPieceCache
+from .workers import WorkerState
+from .sessions import SessionTable
+from . import metrics
 
 
 # --- логи ---
+# JSON-строки пишет фоновый поток, LOG_SAMPLE_RATE — доля запросов, попадающих в лог
 LOG_FILE = os.getenv("LOG_FILE", "requests.log")
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# запросы дольше SLOW_REQUEST_MS пишутся всегда, с разбивкой по стадиям (0 — выключено)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "250"))
+SLOW_LOG_FILE = os.getenv("SLOW_LOG_FILE", "slow_requests.log")
+request_log = RequestLog(
+    LOG_FILE, sample_rate=LOG_SAMPLE_RATE, queue_size=LOG_QUEUE_SIZE, slow_path=SLOW_LOG_FILE
 )
 
 app = FastAPI()
 
-MODEL_PATH = os.getenv("MODEL_PATH", "/model/model.onnx")
-HF_URL = "https://huggingface.co/artzzzzz/ner/resolve/main/model.onnx"
+# вариант модели: fp32 — MODEL_PATH как есть, int8 — <имя>_int8.onnx рядом с ним (см. train/export_onnx.py)
+MODEL_FILES = {"fp32": "model.onnx", "int8": "model_int8.onnx"}
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32")
+if MODEL_VARIANT not in MODEL_FILES:
+    raise ValueError(f"MODEL_VARIANT должен быть одним из {sorted(MODEL_FILES)}, получено {MODEL_VARIANT!r}")
+
+FP32_MODEL_PATH = os.getenv("MODEL_PATH", "/model/model.onnx")
+MODEL_DIR = os.path.dirname(FP32_MODEL_PATH)
+MODEL_PATH = (
+    os.path.splitext(FP32_MODEL_PATH)[0] + "_int8.onnx" if MODEL_VARIANT == "int8" else FP32_MODEL_PATH
+)
+HF_URL = f"https://huggingface.co/artzzzzz/ner/resolve/main/{MODEL_FILES[MODEL_VARIANT]}"
 
 def ensure_model():
     os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
@@ -38,167 +66,914 @@ def ensure_model():
         except Exception as e:
             print(f"Ошибка загрузки модели: {e}")
     else:
-        print(f"Модель уже загружена в {MODEL_PATH}")
+        print(f"Модель ({MODEL_VARIANT}) уже загружена в {MODEL_PATH}")
 
 ensure_model()
 
 TOKENIZER_NAME = "DeepPavlov/rubert-base-cased"
 MAX_LEN = 500
 
-LABELS = [
-    "O",
-    "B-TYPE", "I-TYPE",
-    "B-BRAND", "I-BRAND",
-    "B-VOLUME", "I-VOLUME",
-    "B-PERCENT", "I-PERCENT"
-]
-
 # --- middleware для активных запросов ---
-active_requests = 0
-max_active_requests = 0
-lock = asyncio.Lock()
+# чистый ASGI: BaseHTTPMiddleware оборачивает ответ в StreamingResponse, который читает
+# receive() и забирает тело запроса у потоковых эндпоинтов (/predict_stream)
+def endpoint_label(scope):
+    # метка эндпоинта только для известных маршрутов, чтобы не плодить серии
+    route = scope.get("route")
+    return route.path if route is not None else "other"
 
-async def track_requests_middleware(request: Request, call_next):
-    global active_requests, max_active_requests
+class TrackRequestsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.active_requests = 0
 
-    async with lock:
-        active_requests += 1
-        if active_requests > max_active_requests:
-            max_active_requests = active_requests
-        current = active_requests
-        peak = max_active_requests
-    print(f"▶️ старт запроса, активных={current}, максимум={peak}")
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-    response = await call_next(request)
+        # весь код выполняется в потоке event loop, блокировка не нужна
+        self.active_requests += 1
+        metrics.IN_FLIGHT.set(self.active_requests)
 
-    async with lock:
-        active_requests -= 1
-        current = active_requests
-    print(f"✅ конец запроса, активных={current}, максимум={peak}")
+        t0 = time.perf_counter()
+        status = 500
 
-    return response
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
 
-app.add_middleware(BaseHTTPMiddleware, dispatch=track_requests_middleware)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = endpoint_label(scope)
+            metrics.REQUESTS.labels(endpoint, status).inc()
+            metrics.REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - t0)
+            self.active_requests -= 1
+            metrics.IN_FLIGHT.set(self.active_requests)
+
+app.add_middleware(TrackRequestsMiddleware)
 
 # --- загружаем токенизатор и модель ---
-tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, use_fast=True)
-
-so = ort.SessionOptions()
-so.intra_op_num_threads = 1
-so.inter_op_num_threads = 1
-session = ort.InferenceSession(
-    MODEL_PATH,
-    sess_options=so,
-    providers=["CPUExecutionProvider"]
-)
+# при preload_app (gunicorn.conf.py) это выполняется один раз в master,
+# воркеры получают токенизатор и веса через fork (copy-on-write)
+# токенизатор читается из tokenizer.json рядом с моделью (train/export_onnx.py) через tokenizers;
+# transformers импортируется, только если файла нет, — и сохраняет его для следующего старта
+TOKENIZER_FILE = os.getenv("TOKENIZER_FILE", os.path.join(MODEL_DIR, "tokenizer.json"))
+
+def load_tokenizer():
+    t0 = time.perf_counter()
+    if os.path.exists(TOKENIZER_FILE):
+        tok, source = FastTokenizer.from_file(TOKENIZER_FILE), TOKENIZER_FILE
+    else:
+        from transformers import AutoTokenizer
+        backend = AutoTokenizer.from_pretrained(TOKENIZER_NAME, use_fast=True).backend_tokenizer
+        try:
+            backend.save(TOKENIZER_FILE)
+        except Exception as e:
+            print(f"Не удалось сохранить {TOKENIZER_FILE}: {e}")
+        tok, source = FastTokenizer(backend), TOKENIZER_NAME
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Токенизатор ({source}) загружен за {time.perf_counter() - t0:.2f} с, RSS {rss_mb:.0f} МБ")
+    return tok
+
+tokenizer = load_tokenizer()
+
+SHARE_WEIGHTS = os.getenv("SHARE_WEIGHTS", "1") == "1"
+# граф без весов (или путь к файлу при SHARE_WEIGHTS=0) и общие веса
+model_graph, model_weights = load_model(MODEL_PATH, share_weights=SHARE_WEIGHTS)
+
+# пул сессий: ORT_SESSIONS сессий по ORT_THREADS потоков каждая,
+# создаётся в каждом воркере на старте (см. startup)
+ORT_SESSIONS = int(os.getenv("ORT_SESSIONS", "1"))
+ORT_THREADS = int(os.getenv("ORT_THREADS", "1"))
+pool = None
 
 class UserQuery(BaseModel):
     input: str
+    # ключ сессии клиента (поле ввода): новый запрос отменяет ещё не отвеченные старые
+    session_id: Optional[str] = None
 
-def merge_bio_spans(spans):
-    # --- объединение BIO-спанов в сущности ---
-    if not spans:
-        return []
-    merged = []
-    current_start, current_end, current_label = spans[0]
-    for start, end, label in spans[1:]:
-        if current_end == start:
-            current_end = end
-        else:
-            merged.append({
-                "start_index": current_start,
-                "end_index": current_end,
-                "entity": current_label
-            })
-            current_start, current_end, current_label = start, end, label
-    merged.append({
-        "start_index": current_start,
-        "end_index": current_end,
-        "entity": current_label
-    })
-    return merged
+class BatchQuery(BaseModel):
+    inputs: List[str]
 
 # --- очередь для батчинга ---
-queue = asyncio.Queue()
-BATCH_SIZE = 5
-MAX_WAIT_MS = 50
+# строки группируются по длине в токенах, пачка ограничена бюджетом токенов
+TOKEN_BUDGET = int(os.getenv("TOKEN_BUDGET", "4096"))
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", "128"))
+MIN_WAIT_MS = float(os.getenv("MIN_WAIT_MS", "1"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "50"))
+MAX_BATCH_INPUTS = int(os.getenv("MAX_BATCH_INPUTS", "256"))
 
-async def batch_worker():
-    while True:
-        reqs = []
-        # ожидаем первый запрос
-        item = await queue.get()
-        reqs.append(item)
+# --- контроль допуска ---
+# QUEUE_MAX — жёсткая граница очереди, из неё bulk занимает не больше BULK_QUEUE_MAX;
+# с глубины DEGRADE_QUEUE_DEPTH своего класса новые тексты размечаются правилами без модели
+# (0 — не деградировать, отвечать 503)
+QUEUE_MAX = int(os.getenv("QUEUE_MAX", "4096"))
+BULK_QUEUE_MAX = int(os.getenv("BULK_QUEUE_MAX", str(QUEUE_MAX // 2)))
+DEGRADE_QUEUE_DEPTH = int(os.getenv("DEGRADE_QUEUE_DEPTH", "2048"))
+# дедлайн запроса: заголовок X-Request-Timeout-Ms или значение по умолчанию
+REQUEST_TIMEOUT_MS = float(os.getenv("REQUEST_TIMEOUT_MS", "2000"))
 
-        # собираем пачку
-        try:
-            while len(reqs) < BATCH_SIZE:
-                item = await asyncio.wait_for(queue.get(), timeout=MAX_WAIT_MS/1000)
-                reqs.append(item)
-        except asyncio.TimeoutError:
-            pass
-
-        texts = [r["text"] for r in reqs]
-        # токенизация сразу пачкой
-        tokens = tokenizer(
+scheduler = BatchScheduler(
+    token_budget=TOKEN_BUDGET,
+    max_batch=MAX_BATCH_ROWS,
+    min_wait_ms=MIN_WAIT_MS,
+    max_wait_ms=MAX_WAIT_MS,
+    max_pending=QUEUE_MAX,
+    max_bulk=BULK_QUEUE_MAX,
+    on_expired=lambda row: row_expired(row),
+)
+
+# --- классы приоритета ---
+# заголовок X-Priority: interactive (по умолчанию для /predict и /predict_batch) или bulk
+# (по умолчанию для /predict_stream); пачки набираются сначала из interactive
+metrics.LANE_QUEUE_DEPTH.fn = lambda: {lane: scheduler.depth(lane) for lane in LANES}
+
+def request_lane(request, default=INTERACTIVE):
+    lane = request.headers.get("x-priority", default).strip().lower()
+    if lane not in LANES:
+        raise HTTPException(status_code=400, detail=f"X-Priority must be one of {', '.join(LANES)}")
+    return lane
+
+# --- кэш результатов перед очередью ---
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "100000"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "3600"))
+# local — свой кэш в каждом воркере, shared — общий для воркеров в /dev/shm
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "/dev/shm/ner-cache")
+SHARED_CACHE_SLOT_BYTES = int(os.getenv("SHARED_CACHE_SLOT_BYTES", "256"))
+
+if CACHE_BACKEND == "shared" and CACHE_SIZE > 0:
+    cache = SharedResultCache(
+        SHARED_CACHE_PATH, LABELS,
+        nslots=CACHE_SIZE, slot_size=SHARED_CACHE_SLOT_BYTES, ttl_s=CACHE_TTL_S,
+    )
+else:
+    cache = ResultCache(maxsize=CACHE_SIZE, ttl_s=CACHE_TTL_S)
+
+# --- быстрый путь без модели: объёмы, проценты, известные бренды ---
+FAST_LANE = os.getenv("FAST_LANE", "0") == "1"
+BRANDS_FILE = os.getenv("BRANDS_FILE", os.path.join(MODEL_DIR, "brands.txt"))
+brands = load_brands(BRANDS_FILE)
+fast_lane = FastLane(brands) if FAST_LANE else None
+rule_tagger = RuleTagger(brands)
+FAST_LANE_QUERIES = metrics.Counter(
+    "ner_fast_lane_total", "Запросы, проверенные быстрым путём: hit — ответ без модели", ("result",)
+)
+
+metrics.Gauge("ner_queue_depth", "Строк в очереди планировщика", fn=lambda: len(scheduler))
+# счётчики общего кэша уже суммарные по воркерам — при сложении снимков берётся максимум
+CACHE_AGGREGATE = "max" if isinstance(cache, SharedResultCache) else "sum"
+metrics.Gauge("ner_cache_size", "Записей в кэше результатов", fn=lambda: len(cache), aggregate=CACHE_AGGREGATE)
+metrics.CounterFunc(
+    "ner_cache_hits_total", "Попадания в кэш результатов", fn=lambda: cache.hits, aggregate=CACHE_AGGREGATE
+)
+metrics.CounterFunc(
+    "ner_cache_misses_total", "Промахи кэша результатов", fn=lambda: cache.misses, aggregate=CACHE_AGGREGATE
+)
+
+# --- кэш токенизации по словам ---
+# повторяющиеся слова не гоняются через токенизатор; на старте сверяется с ним (см. warmup)
+WORDPIECE_CACHE = os.getenv("WORDPIECE_CACHE", "1") == "1"
+WORDPIECE_CACHE_SIZE = int(os.getenv("WORDPIECE_CACHE_SIZE", "200000"))
+wordpieces = WordPieceCache(tokenizer, MAX_LEN, maxsize=WORDPIECE_CACHE_SIZE) if WORDPIECE_CACHE else None
+# сверка до приёма запросов (при preload_app — один раз в master): ни одна строка
+# не успевает уйти в модель с токенизацией кэша, которому нельзя доверять
+if wordpieces is not None:
+    mismatches = wordpieces.verify_parity()
+    if mismatches:
+        # токенизатор режет не так, как ожидает кэш, — работаем без него
+        print(f"Кэш токенизации отключён: расхождение с токенизатором на {mismatches[0]!r}")
+        wordpieces = None
+
+metrics.Gauge("ner_wordpiece_cache_size", "Слов в кэше токенизации", fn=lambda: len(wordpieces or ()))
+metrics.CounterFunc(
+    "ner_wordpiece_cache_hits_total", "Слова, найденные в кэше токенизации",
+    fn=lambda: wordpieces.hits if wordpieces else 0,
+)
+metrics.CounterFunc(
+    "ner_wordpiece_cache_misses_total", "Слова, отправленные в токенизатор",
+    fn=lambda: wordpieces.misses if wordpieces else 0,
+)
+
+def encode_texts(texts):
+    # токенизация без паддинга: длина нужна планировщику до сборки пачки
+    t0 = time.perf_counter()
+    if wordpieces is not None:
+        ids, offsets = wordpieces.encode(texts)
+    else:
+        enc = tokenizer(
             texts,
-            return_tensors="np",
             truncation=True,
-            padding=True,
             max_length=MAX_LEN,
             return_offsets_mapping=True
         )
-        offsets = tokens.pop("offset_mapping")
-
-        input_names = {i.name for i in session.get_inputs()}
-        ort_inputs = {k: v for k, v in tokens.items() if k in input_names}
-
-        outputs = session.run(None, ort_inputs)
-        logits = outputs[0]
-        pred_ids_batch = np.argmax(logits, axis=-1)
-
-        # раздаем результаты каждому запросу
-        for i, r in enumerate(reqs):
-            spans = []
-            for idx, label_id in enumerate(pred_ids_batch[i]):
-                start_char, end_char = offsets[i][idx]
-                if start_char == end_char:
-                    continue
-                label = LABELS[label_id]
-                spans.append((int(start_char), int(end_char), label))
-            entities = merge_bio_spans(spans)
-            r["future"].set_result(entities)
+        ids, offsets = enc["input_ids"], enc["offset_mapping"]
+    metrics.STAGE_LATENCY.labels("tokenize").observe(time.perf_counter() - t0)
+    return ids, offsets
+
+async def run_batch(rows, slot):
+    try:
+        results = await pool.run(predict_rows, rows, tokenizer.pad_token_id)
+    except Exception as e:
+        metrics.ERRORS.labels("inference").inc()
+        for r in rows:
+            if not r.future.done():
+                r.future.set_exception(e)
+        return
+    finally:
+        slot.release()
+
+    # раздаем результаты каждому запросу
+    if rows[0].stages is not None:
+        rows[0].stages["resolved_at"] = time.perf_counter()
+    for r, entities in zip(rows, results):
+        if not r.future.done():
+            r.future.set_result(entities)
+
+async def batch_worker():
+    # пачку забираем из очереди только при свободной сессии,
+    # пока модель занята — запросы продолжают копиться в бакетах
+    slot = asyncio.Semaphore(pool.size)
+    while True:
+        await slot.acquire()
+        _, rows = await scheduler.next_batch()
+        now = time.monotonic()
+        for r in rows:
+            r.queue_wait = now - r.enqueued_at
+            metrics.STAGE_LATENCY.labels("queue_wait").observe(r.queue_wait)
+            metrics.LANE_QUEUE_WAIT.labels(r.lane).observe(r.queue_wait)
+        asyncio.create_task(run_batch(rows, slot))
+
+# --- прогрев и готовность ---
+# прогреваются все формы пачек, которые собирает планировщик (бакет × число строк)
+# --- состояние воркеров gunicorn ---
+# при WORKERS > 1 каждый воркер раз в WORKER_STATE_FLUSH_S публикует снимок метрик и готовности:
+# /metrics складывает снимки всех воркеров контейнера, /ready ждёт прогрева всех WORKERS
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_STATE_DIR = os.getenv("WORKER_STATE_DIR", "/dev/shm/ner-workers")
+WORKER_STATE_FLUSH_S = float(os.getenv("WORKER_STATE_FLUSH_S", "1"))
+worker_state = WorkerState(WORKER_STATE_DIR) if WORKERS > 1 else None
+
+def publish_state():
+    worker_state.publish({"ready": ready, "metrics": metrics.snapshot()})
+
+async def publish_loop():
+    while True:
+        publish_state()
+        await asyncio.sleep(WORKER_STATE_FLUSH_S)
+
+WARMUP = os.getenv("WARMUP", "1") == "1"
+WARMUP_MAX_LEN = int(os.getenv("WARMUP_MAX_LEN", "512"))
+ready = False
+
+@app.on_event("shutdown")
+async def shutdown():
+    # дописываем оставшиеся в очереди записи лога
+    request_log.stop()
+    if worker_state is not None:
+        # счётчики с последнего снимка не теряются
+        publish_state()
 
 @app.on_event("startup")
 async def startup():
-    # прогрев модели
-    dummy = tokenizer("warmup", return_tensors="np", truncation=True, padding=True, max_length=8)
-    input_names = {i.name for i in session.get_inputs()}
-    ort_inputs = {k: v for k, v in dummy.items() if k in input_names}
-    session.run(None, ort_inputs)
-    print("Warmup done")
+    # состояние воркера: сессии ORT поверх общих весов, регистрация в общем кэше
+    global pool, model_generation
+    pool = SessionPool(
+        model_graph, size=ORT_SESSIONS, threads_per_session=ORT_THREADS, weights=model_weights,
+        batch_tokens=scheduler.max_tokens(),
+    )
+    cache.attach()
+    if worker_state is not None:
+        metrics.reset()
+    # модель воркера соответствует поколению кэша на момент fork (см. reload_shared_model)
+    model_generation = cache.generation
+    request_log.start()
+    asyncio.create_task(watch_loop_lag())
+    if worker_state is not None:
+        asyncio.create_task(publish_loop())
+    if session_table is not None:
+        asyncio.create_task(watch_sessions())
+
+    # прогрев в фоне: /health отвечает сразу, /ready — после прогрева
+    asyncio.create_task(warmup())
+
+async def warmup():
+    global ready
+    t0 = time.perf_counter()
+    shapes = scheduler.shapes(max_len=WARMUP_MAX_LEN) if WARMUP else []
+    await pool.warmup(shapes)
+    print(f"Warmup done: {len(shapes)} форм пачек за {time.perf_counter() - t0:.1f} с")
 
     # запуск воркера батчинга
     asyncio.create_task(batch_worker())
+    ready = True
+    if worker_state is not None:
+        publish_state()
+    if MODEL_WATCH_S > 0 and worker_state is None:
+        # при WORKERS > 1 за файлом следит master (gunicorn.conf.py)
+        asyncio.create_task(watch_model())
 
-@app.post("/predict")
-async def predict(req: UserQuery, request: Request):
-    input_text = (req.input or "").strip().lower()
-    if not input_text:
-        return []
+# --- горячая перезагрузка модели ---
+# один воркер: новый пул сессий собирается и прогревается в фоне, затем подменяет текущий
+# между пачками; пачки, уже отданные старому пулу, досчитываются им.
+# WORKERS > 1: модель перечитывает master gunicorn по SIGHUP (reload_shared_model) и форкает
+# новые воркеры, веса остаются общими. MODEL_WATCH_S > 0 — следить за файлом модели
+MODEL_WATCH_S = float(os.getenv("MODEL_WATCH_S", "0"))
+reload_lock = asyncio.Lock()
+# поколение кэша, которому соответствует модель воркера: результаты строк,
+# поставленных в очередь до подмены (или посчитанных старым воркером), в кэш не попадают
+model_generation = 0
+MODEL_RELOADS = metrics.Counter(
+    "ner_model_reloads_total", "Перезагрузки модели", labelnames=("result",)
+)
+
+def model_mtime():
+    try:
+        return os.stat(MODEL_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+async def reload_model():
+    global pool, model_generation
+    async with reload_lock:
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            # чтение и создание сессий — в отдельном потоке, event loop продолжает обслуживать запросы
+            new_bytes, new_weights = await loop.run_in_executor(
+                None, load_model, MODEL_PATH, SHARE_WEIGHTS
+            )
+            new_pool = await loop.run_in_executor(None, partial(
+                SessionPool, new_bytes, size=ORT_SESSIONS, threads_per_session=ORT_THREADS,
+                weights=new_weights, batch_tokens=scheduler.max_tokens(),
+            ))
+            await new_pool.warmup(scheduler.shapes(max_len=WARMUP_MAX_LEN) if WARMUP else [])
+        except Exception:
+            MODEL_RELOADS.labels("error").inc()
+            raise
+
+        # подмена без await: следующая пачка уйдёт уже в новый пул
+        old_pool, pool = pool, new_pool
+        cache.clear()
+        model_generation = cache.generation
+        # новые запросы не присоединяются к строкам, поставленным до подмены
+        inflight.clear()
+        old_pool.close()
+        MODEL_RELOADS.labels("ok").inc()
+        elapsed = time.perf_counter() - t0
+        print(f"Модель перезагружена из {MODEL_PATH} за {elapsed:.1f} с")
+        return elapsed
+
+def reload_shared_model():
+    """
+    Перечитывает модель в master gunicorn по SIGHUP (gunicorn.conf.py, on_reload):
+    воркеры, которые форкнутся следом, получат новые веса общими. Старые воркеры досчитывают
+    свои запросы старой моделью, их результаты в кэш уже не попадают.
+    """
+    global model_graph, model_weights
+    t0 = time.perf_counter()
+    try:
+        graph, weights = load_model(MODEL_PATH, share_weights=SHARE_WEIGHTS)
+    except Exception as e:
+        # новые воркеры поднимутся со старой моделью
+        MODEL_RELOADS.labels("error").inc()
+        print(f"Ошибка перезагрузки модели: {e}")
+    else:
+        model_graph, model_weights = graph, weights
+        cache.clear()
+        MODEL_RELOADS.labels("ok").inc()
+        print(f"Модель перезагружена из {MODEL_PATH} за {time.perf_counter() - t0:.1f} с")
+    if worker_state is not None:
+        # счётчик перезагрузок master попадает в /metrics вместе со снимками воркеров
+        publish_state()
+
+async def watch_model():
+    seen = model_mtime()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_S)
+        mtime = model_mtime()
+        if mtime is None or mtime == seen:
+            continue
+        seen = mtime
+        try:
+            await reload_model()
+        except Exception as e:
+            # остаёмся на старой модели до следующего изменения файла
+            print(f"Ошибка перезагрузки модели: {e}")
+
+def prepare_text(text):
+    input_text = (text or "").strip().lower()
     if len(input_text) > MAX_LEN:
         raise HTTPException(status_code=413, detail=f"Input too long (>{MAX_LEN} chars)")
+    return input_text
+
+# --- схлопывание одинаковых запросов ---
+# каноническая форма → строка, которая стоит в очереди или считается
+inflight = {}
+COALESCED = metrics.Counter(
+    "ner_coalesced_total", "Запросы, присоединённые к уже ожидающей строке с тем же текстом"
+)
+
+def forget(row):
+    # строку, которая больше не посчитается, снимаем из inflight сразу, а не в on_resolved:
+    # запрос с тем же текстом, пришедший раньше колбэка, получит новую строку
+    if inflight.get(row.text) is row:
+        del inflight[row.text]
+
+def row_expired(row):
+    forget(row)
+    metrics.ADMISSION.labels("expired").inc()
+
+def on_resolved(key, generation, fut):
+    row = inflight.get(key)
+    if row is not None and row.future is fut:
+        del inflight[key]
+    if not fut.cancelled() and fut.exception() is None:
+        cache.put(key, fut.result(), generation)
+
+# --- вытеснение устаревших запросов сессии ---
+# поиск шлёт /predict на каждое нажатие: "мол", "моло", "молок", "молоко".
+# новый запрос с тем же ключом сессии отвечает старым 409, а их строки, которые больше
+# никто не ждёт, убираются из очереди до сборки пачки.
+# нажатия одной сессии попадают в разные воркеры: при WORKERS > 1 номер последнего запроса
+# сессии хранится в общей таблице, воркер раз в SESSION_POLL_MS сверяет с ней свои ожидающие
+# запросы, пока они есть; без ожидающих запросов с ключом сессии таблица не читается. Между репликами запросы с ключом сессии разводит маршрутизатор (app/router.py)
+SESSION_TABLE_PATH = os.getenv("SESSION_TABLE_PATH", "/dev/shm/ner-sessions")
+SESSION_TABLE_SLOTS = int(os.getenv("SESSION_TABLE_SLOTS", "65536"))
+SESSION_POLL_MS = float(os.getenv("SESSION_POLL_MS", "5"))
+session_table = SessionTable(SESSION_TABLE_PATH, SESSION_TABLE_SLOTS) if WORKERS > 1 else None
+# ключ сессии → (future вытеснения, метка в session_table) ожидающего запроса этого воркера
+sessions = {}
+# будит watch_sessions, когда появляется ожидающий запрос с ключом сессии
+sessions_pending = asyncio.Event()
+
+class Superseded(Exception):
+    pass
+
+def session_key(req, request):
+    return req.session_id or request.headers.get("x-session-id") or None
+
+def supersede(session):
+    """Регистрирует запрос сессии и вытесняет предыдущий; возвращает future вытеснения нового."""
+    if session is None:
+        return None
+    old = sessions.get(session)
+    if old is not None and not old[0].done():
+        old[0].set_result(True)
+    fut = asyncio.get_running_loop().create_future()
+    sessions[session] = (fut, session_table.bump(session) if session_table is not None else None)
+    sessions_pending.set()
+    return fut
+
+def release_session(session, superseded):
+    if session is not None and session in sessions and sessions[session][0] is superseded:
+        del sessions[session]
+
+async def watch_sessions():
+    # вытесняет ожидающие запросы воркера, если новый запрос их сессии пришёл в другой воркер
+    while True:
+        if not sessions:
+            sessions_pending.clear()
+            await sessions_pending.wait()
+        await asyncio.sleep(SESSION_POLL_MS / 1000)
+        for fut, token in sessions.values():
+            if not fut.done() and session_table.superseded(token):
+                fut.set_result(True)
+
+def leave(rows, superseded=False):
+    """Запрос перестал ждать строки: строки без ожидающих убираются из очереди."""
+    for row in rows:
+        row.waiters -= 1
+        if row.waiters == 0 and not row.future.done() and scheduler.discard(row):
+            # отменённая строка в кэш не попадает
+            forget(row)
+            row.future.cancel()
+            if superseded:
+                metrics.SUPERSEDED.labels("dropped").inc()
+            else:
+                metrics.ADMISSION.labels("expired").inc()
+
+def request_deadline(request):
+    timeout_ms = request.headers.get("x-request-timeout-ms")
+    try:
+        timeout_ms = float(timeout_ms) if timeout_ms else REQUEST_TIMEOUT_MS
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Request-Timeout-Ms")
+    return time.monotonic() + timeout_ms / 1000
+
+def overloaded(n, lane=INTERACTIVE):
+    # очередь bulk не переводит интерактивные запросы в деградацию
+    if DEGRADE_QUEUE_DEPTH > 0 and scheduler.depth(lane) >= DEGRADE_QUEUE_DEPTH:
+        return True
+    return not scheduler.has_room(n, lane)
+
+async def submit(texts, deadline, timings=None, lane=INTERACTIVE, superseded=None):
+    """
+    Сущности по каждому тексту и флаг деградации (часть ответов — по правилам, без модели).
+    В `timings` (если передан) пишется разбивка времени по стадиям, в секундах.
+    Если future `superseded` завершится раньше ответа, бросается Superseded.
+    """
+    timings = {} if timings is None else timings
+    # в модель и кэш идёт каноническая форма (как в обучающем пайплайне),
+    # спаны затем переводятся обратно в координаты исходного текста
+    keys = [canonicalize(t) for t in texts]
+    results = [None] * len(texts)
+    misses = []
+    for i, (key, _) in enumerate(keys):
+        if fast_lane is not None:
+            resolved = fast_lane.resolve(key)
+            FAST_LANE_QUERIES.labels("miss" if resolved is None else "hit").inc()
+            if resolved is not None:
+                results[i] = resolved
+                continue
+        cached = cache.get(key)
+        if cached is None:
+            misses.append(i)
+        else:
+            results[i] = cached
+
+    degraded = False
+    if misses:
+        # одинаковые тексты, уже стоящие в очереди или в работе, не добавляют строк в пачку
+        new_texts = list(dict.fromkeys(keys[i][0] for i in misses if keys[i][0] not in inflight))
+        COALESCED.inc(len(misses) - len(new_texts))
+
+        if new_texts and overloaded(len(new_texts), lane):
+            if DEGRADE_QUEUE_DEPTH <= 0:
+                metrics.ADMISSION.labels("rejected").inc()
+                raise HTTPException(status_code=503, detail="Queue is full")
+            # очередь переполнена — новые тексты размечаем правилами, в кэш не кладём
+            metrics.ADMISSION.labels("degraded").inc()
+            degraded = True
+            tagged = {t: rule_tagger.tag(t) for t in new_texts}
+            for i in misses:
+                if keys[i][0] in tagged:
+                    results[i] = tagged[keys[i][0]]
+            misses = [i for i in misses if results[i] is None]
+        elif new_texts:
+            # одна токенизация на все новые тексты, дальше каждая строка идёт в свой бакет
+            loop = asyncio.get_event_loop()
+            t0 = time.perf_counter()
+            ids, offsets = encode_texts(new_texts)
+            timings["tokenize"] = time.perf_counter() - t0
+            rows = [
+                Row(t, i, o, loop.create_future(), lane=lane) for t, i, o in zip(new_texts, ids, offsets)
+            ]
+            try:
+                scheduler.submit(rows)
+            except QueueFull:
+                # место уже проверено в overloaded(), это страховка: строки не регистрируются в inflight
+                metrics.ADMISSION.labels("rejected").inc()
+                raise HTTPException(status_code=503, detail="Queue is full")
+            for r in rows:
+                r.future.add_done_callback(partial(on_resolved, r.text, model_generation))
+                inflight[r.text] = r
+
+    if misses:
+        # строка живёт до самого позднего дедлайна своих ожидающих
+        waiting, rows = [], []
+        for i in misses:
+            row = inflight[keys[i][0]]
+            row.deadline = max(row.deadline or 0.0, deadline)
+            if lane == INTERACTIVE:
+                # интерактивный запрос не ждёт в очереди bulk за строкой с тем же текстом
+                scheduler.promote(row)
+            row.waiters += 1
+            rows.append(row)
+            waiting.append(row.future)
+
+        t0 = time.perf_counter()
+        # asyncio.wait не отменяет строки: отключившийся клиент не отменяет результат для остальных
+        gathered = asyncio.ensure_future(asyncio.wait(waiting))
+        try:
+            done, _ = await asyncio.wait(
+                [gathered] if superseded is None else [gathered, superseded],
+                timeout=max(0.0, deadline - time.monotonic()),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if gathered not in done:
+                if superseded is not None and superseded in done:
+                    raise Superseded
+                raise asyncio.TimeoutError
+            predicted = [f.result() for f in waiting]
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            metrics.ADMISSION.labels("timeout").inc()
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
+        finally:
+            if not gathered.done():
+                # отключение клиента: ждать строки уже некому
+                gathered.cancel()
+            leave(rows, superseded is not None and superseded.done())
+            timings["wait"] = time.perf_counter() - t0
+            row_timings(rows, timings)
+        for i, entities in zip(misses, predicted):
+            results[i] = entities
+
+    return [restore_offsets(r, index) for r, (_, index) in zip(results, keys)], degraded
+
+# --- сериализация ответа ---
+# ответ отдаётся готовым ORJSONResponse: без прохода jsonable_encoder по спискам сущностей.
+# format=compact — параллельные массивы начал, концов и id меток (индексы в /labels)
+ResponseFormat = Literal["full", "compact"]
+
+def json_response(content, degraded=False):
+    return ORJSONResponse(content, headers={"X-Degraded": "1"} if degraded else None)
+
+# --- медленные запросы и профилирование ---
+ROW_STAGES = ("pack", "inference", "postprocess")
+LOOP_LAG_INTERVAL_S = 0.1
+LOOP_LAG = metrics.Histogram(
+    "ner_event_loop_lag_seconds", "Насколько позже заданного просыпается event loop"
+)
+loop_lag = 0.0
+profiling = False
+
+def row_timings(rows, timings):
+    # по строкам, которые ждал запрос, берётся самая долгая — она и определяет ответ
+    done = [r for r in rows if r.stages is not None]
+    if not done:
+        return
+    timings["queue_wait"] = max(r.queue_wait for r in done)
+    for stage in ROW_STAGES:
+        timings[stage] = max(r.stages[stage] for r in done)
+    timings["batch_rows"] = max(r.stages["batch_rows"] for r in done)
+    # от готовности пачки до продолжения запроса: занятость event loop
+    resolved = [r.stages["resolved_at"] for r in done if "resolved_at" in r.stages]
+    if resolved:
+        timings["resume"] = time.perf_counter() - max(resolved)
+
+def log_if_slow(endpoint, request, t0, timings, **fields):
+    elapsed = (time.perf_counter() - t0) * 1000
+    if SLOW_REQUEST_MS <= 0 or elapsed < SLOW_REQUEST_MS:
+        return
+    request_log.log_slow(
+        endpoint=endpoint,
+        client=request.client.host if request.client else "unknown",
+        ms=round(elapsed, 1),
+        stages={k: round(v * 1000, 2) if isinstance(v, float) else v for k, v in timings.items()},
+        queue_depth=len(scheduler),
+        loop_lag_ms=round(loop_lag * 1000, 2),
+        **fields,
+    )
+
+async def watch_loop_lag():
+    # блокирующий код в event loop виден как опоздание таймера
+    global loop_lag
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_S)
+        loop_lag = max(0.0, time.perf_counter() - t0 - LOOP_LAG_INTERVAL_S)
+        LOOP_LAG.observe(loop_lag)
+
+@app.post("/predict")
+async def predict(
+    req: UserQuery, request: Request, fmt: ResponseFormat = Query("full", alias="format")
+):
+    t0 = time.perf_counter()
+    deadline = request_deadline(request)
+    lane = request_lane(request)
+    input_text = prepare_text(req.input)
+    session = session_key(req, request)
+    superseded = supersede(session)
+    if not input_text:
+        release_session(session, superseded)
+        return json_response(compact([]) if fmt == "compact" else [])
 
-    loop = asyncio.get_event_loop()
-    fut = loop.create_future()
-    await queue.put({"text": input_text, "future": fut})
-    entities = await fut
+    timings = {}
+    try:
+        results, degraded = await submit([input_text], deadline, timings, lane, superseded)
+    except Superseded:
+        metrics.SUPERSEDED.labels("request").inc()
+        raise HTTPException(status_code=409, detail="Superseded by a newer request")
+    finally:
+        release_session(session, superseded)
+        metrics.LANE_LATENCY.labels(lane).observe(time.perf_counter() - t0)
+        log_if_slow("/predict", request, t0, timings, lane=lane, session=session, input=input_text)
+    entities = results[0]
 
-    elapsed = 0
+    elapsed = (time.perf_counter() - t0) * 1000
     client_ip = request.client.host if request.client else "unknown"
-    logging.info(
-        "Client %s | Input: %r | Entities: %s | Time: %.1f ms",
-        client_ip, input_text, entities, elapsed
+    request_log.log(
+        endpoint="/predict", client=client_ip, input=input_text,
+        entities=entities, ms=round(elapsed, 1), degraded=degraded,
     )
-    print(f"[PREDICT] {client_ip} | '{input_text}' | {elapsed:.1f} ms")
-    return entities
+    return json_response(compact(entities) if fmt == "compact" else entities, degraded)
+
+@app.post("/predict_batch")
+async def predict_batch(
+    req: BatchQuery, request: Request, fmt: ResponseFormat = Query("full", alias="format")
+):
+    t0 = time.perf_counter()
+    deadline = request_deadline(request)
+    lane = request_lane(request)
+    if len(req.inputs) > MAX_BATCH_INPUTS:
+        raise HTTPException(status_code=413, detail=f"Too many inputs (>{MAX_BATCH_INPUTS})")
+    texts = [prepare_text(t) for t in req.inputs]
+
+    # пустые строки в модель не отправляем
+    non_empty = [i for i, t in enumerate(texts) if t]
+    results = [[] for _ in texts]
+    degraded = False
+    if non_empty:
+        timings = {}
+        try:
+            predicted, degraded = await submit([texts[i] for i in non_empty], deadline, timings, lane)
+        finally:
+            metrics.LANE_LATENCY.labels(lane).observe(time.perf_counter() - t0)
+            log_if_slow("/predict_batch", request, t0, timings, lane=lane, inputs=len(texts))
+        for i, entities in zip(non_empty, predicted):
+            results[i] = entities
+
+    client_ip = request.client.host if request.client else "unknown"
+    request_log.log(endpoint="/predict_batch", client=client_ip, inputs=len(texts), degraded=degraded)
+    if fmt == "compact":
+        results = [compact(r) for r in results]
+    return json_response(results, degraded)
+
+# --- потоковая разметка больших выгрузок ---
+# строки тела режутся на пачки по STREAM_CHUNK, в работе не больше STREAM_INFLIGHT пачек:
+# пока ответы не отданы клиенту, тело дальше не читается
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "256"))
+STREAM_INFLIGHT = int(os.getenv("STREAM_INFLIGHT", "4"))
+STREAM_TIMEOUT_MS = float(os.getenv("STREAM_TIMEOUT_MS", "60000"))
+# строка тела длиннее этого не буферизуется: в ответ {"error": ...}, байты до \n пропускаются
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", str(8 * MAX_LEN)))
+
+async def wait_for_capacity(n, lane):
+    # массовая разметка ждёт места в очереди, а не уходит в деградированный ответ
+    while overloaded(n, lane):
+        await asyncio.sleep(MAX_WAIT_MS / 1000)
+
+async def tag_chunk(lines, first, ndjson, fmt, lane):
+    # first — номер первой строки пачки во входе (с 1), ошибки ссылаются на строку входа
+    out = [None] * len(lines)
+    texts = {}
+    for i, line in enumerate(lines):
+        if line is None:
+            out[i] = {"error": f"Line too long (>{STREAM_MAX_LINE_BYTES} bytes)", "line": first + i}
+            continue
+        try:
+            text = prepare_text(parse_line(line, ndjson))
+        except HTTPException as e:
+            out[i] = {"error": e.detail, "line": first + i}
+            continue
+        except ValueError as e:
+            out[i] = {"error": f"Invalid line: {e}", "line": first + i}
+            continue
+        if text:
+            texts[i] = text
+        else:
+            out[i] = {"entities": compact([]) if fmt == "compact" else []}
+
+    if texts:
+        await wait_for_capacity(len(texts), lane)
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + STREAM_TIMEOUT_MS / 1000
+        try:
+            predicted, degraded = await submit(list(texts.values()), deadline, lane=lane)
+        except HTTPException as e:
+            predicted, degraded = [e.detail] * len(texts), False
+        except Exception as e:
+            # ошибка модели не обрывает поток: строки пачки получают ошибку, следующие пачки идут дальше
+            predicted, degraded = [f"Inference failed: {e}"] * len(texts), False
+        metrics.LANE_LATENCY.labels(lane).observe(time.perf_counter() - t0)
+        for i, entities in zip(texts, predicted):
+            if isinstance(entities, str):
+                out[i] = {"error": entities, "line": first + i}
+                continue
+            if fmt == "compact":
+                entities = compact(entities)
+            if degraded:
+                out[i] = {"entities": entities, "degraded": True}
+            else:
+                out[i] = {"entities": entities}
+    return b"".join(ndjson_line(o) for o in out)
+
+async def read_chunks(request, ndjson, fmt, lane, pending):
+    try:
+        chunk, first = [], 1
+        async for line in iter_lines(request, STREAM_MAX_LINE_BYTES):
+            chunk.append(line)
+            if len(chunk) >= STREAM_CHUNK:
+                await pending.put(asyncio.create_task(tag_chunk(chunk, first, ndjson, fmt, lane)))
+                chunk, first = [], first + len(chunk)
+        if chunk:
+            await pending.put(asyncio.create_task(tag_chunk(chunk, first, ndjson, fmt, lane)))
+    finally:
+        await pending.put(None)
+
+@app.post("/predict_stream")
+async def predict_stream(request: Request, fmt: ResponseFormat = Query("full", alias="format")):
+    """
+    Тело — NDJSON (`application/x-ndjson`: строки "текст" или {"input": "текст"})
+    либо обычный текст по запросу на строку. Ответ — NDJSON, строка на строку входа
+    в том же порядке: {"entities": [...]} или {"error": "..."}.
+    """
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    # массовая разметка по умолчанию идёт в bulk и не мешает интерактивным запросам
+    lane = request_lane(request, default=BULK)
+    pending = asyncio.Queue(maxsize=STREAM_INFLIGHT)
+    client_ip = request.client.host if request.client else "unknown"
+
+    async def body():
+        reader = asyncio.create_task(read_chunks(request, ndjson, fmt, lane, pending))
+        n_chunks = 0
+        try:
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                yield await task
+                n_chunks += 1
+            await reader
+        finally:
+            reader.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            request_log.log(endpoint="/predict_stream", client=client_ip, chunks=n_chunks)
+
+    return DuplexStreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.get("/labels")
+async def labels():
+    # расшифровка id меток для format=compact
+    return LABELS
+
+@app.get("/health")
+async def health():
+    # liveness: процесс жив и отвечает
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def readiness():
+    # readiness: модель прогрета, можно отправлять трафик
+    if not ready:
+        raise HTTPException(status_code=503, detail="warming up")
+    if worker_state is not None:
+        # проба попадает в случайный воркер — отвечаем за весь контейнер
+        me = os.getpid()
+        warmed = 1 + sum(
+            1 for pid, alive, state in worker_state.read() if pid != me and alive and state.get("ready")
+        )
+        if warmed < WORKERS:
+            raise HTTPException(status_code=503, detail=f"warming up ({warmed}/{WORKERS} workers)")
+    return {"status": "ready"}
+
+# --- админ-эндпоинты ---
+# /admin/* доступны только с заголовком X-Admin-Token, равным ADMIN_TOKEN;
+# без ADMIN_TOKEN они выключены (404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(
+    seconds: float = Query(10, gt=0, le=60), interval_ms: float = Query(10, ge=1, le=1000)
+):
+    """Стеки всех потоков воркера за `seconds` секунд в collapsed-формате (flamegraph.pl, speedscope)."""
+    global profiling
+    if profiling:
+        raise HTTPException(status_code=409, detail="Profile already running")
+    profiling = True
+    try:
+        loop = asyncio.get_running_loop()
+        stacks = await loop.run_in_executor(None, sample_stacks, seconds, interval_ms / 1000)
+    finally:
+        profiling = False
+    return PlainTextResponse(stacks)
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def admin_reload():
+    if worker_state is not None:
+        # модель перечитывает master, затем заменяет все воркеры (см. reload_shared_model)
+        os.kill(os.getppid(), signal.SIGHUP)
+        return ORJSONResponse({"status": "reloading", "model": MODEL_PATH}, status_code=202)
+    try:
+        elapsed = await reload_model()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return {"status": "reloaded", "model": MODEL_PATH, "seconds": round(elapsed, 3)}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    if worker_state is None:
+        text = metrics.render()
+    else:
+        # свой снимок — свежий и только в памяти (в файл не попадает этот же запрос /metrics),
+        # снимки остальных воркеров — не старше WORKER_STATE_FLUSH_S
+        me = os.getpid()
+        snapshots = [(alive, state["metrics"]) for pid, alive, state in worker_state.read() if pid != me]
+        text = metrics.render_merged([(True, metrics.snapshot())] + snapshots)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
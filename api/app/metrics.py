@@ -0,0 +1,270 @@
+import threading
+
+# --- метрики в текстовом формате Prometheus ---
+# без внешних зависимостей; наблюдения приходят и из event loop, и из потоков ORT,
+# поэтому у каждой метрики своя блокировка.
+# при нескольких воркерах каждый публикует snapshot(), /metrics складывает их (render_merged)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+BATCH_TOKENS_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384)
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+    # как складывать значения воркеров: sum или max (значение уже общее для всех воркеров)
+    aggregate = "sum"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self, children=None):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted((self._children if children is None else children).items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+    def dump(self):
+        """Значения по меткам в виде, пригодном для JSON: [[метки, значение], ...]."""
+        return [[list(key), child.dump()] for key, child in self._children.items()]
+
+    def merge(self, dumps):
+        """Дочерние значения, сложенные из dump() нескольких воркеров."""
+        children = {}
+        for dump in dumps:
+            for key, value in dump:
+                key = tuple(key)
+                if key not in children:
+                    children[key] = self._new_child()
+                children[key].merge(value, self.aggregate)
+        return children
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def dump(self):
+        return self.value
+
+    def merge(self, value, aggregate):
+        self.value = max(self.value, value) if aggregate == "max" else self.value + value
+
+    def render(self, name, names, key):
+        return [f"{name}{_fmt_labels(names, key)} {_fmt_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    Gauge; с `fn` значение вычисляется при каждом запросе /metrics.
+    У метрики с одной меткой fn возвращает словарь {значение метки: значение}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames=(), fn=None, aggregate="sum"):
+        super().__init__(name, doc, labelnames)
+        self.fn = fn
+        self.aggregate = aggregate
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def collect(self):
+        if self.fn is not None:
+            if self.labelnames:
+                for label, value in self.fn().items():
+                    self.labels(label).set(value)
+            else:
+                self._default().set(self.fn())
+
+    def render(self, children=None):
+        if children is None:
+            self.collect()
+        return super().render(children)
+
+    def dump(self):
+        self.collect()
+        return super().dump()
+
+
+class CounterFunc(Gauge):
+    """Счётчик, который ведётся в другом месте (например, в кэше) и читается при /metrics."""
+    kind = "counter"
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def dump(self):
+        return [self.counts, self.sum, self.count]
+
+    def merge(self, value, aggregate):
+        counts, total, count = value
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+    def render(self, name, names, key):
+        lines, acc = [], 0
+        for b, c in zip(self.buckets, self.counts):
+            acc += c
+            le = 'le="%s"' % b
+            lines.append(f"{name}_bucket{_fmt_labels(names, key, le)} {acc}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_fmt_labels(names, key, le)} {self.count}")
+        lines.append(f"{name}_sum{_fmt_labels(names, key)} {self.sum!r}")
+        lines.append(f"{name}_count{_fmt_labels(names, key)} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+REGISTRY = []
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Значения всех метрик процесса — то, что воркер публикует для render_merged."""
+    return {metric.name: metric.dump() for metric in REGISTRY}
+
+
+def reset():
+    """
+    Обнуляет метрики процесса. Воркер вызывает после fork: значения, унаследованные от master,
+    уже учтены в снимке master и не должны повториться в каждом воркере.
+    """
+    for metric in REGISTRY:
+        with metric._lock:
+            metric._children.clear()
+
+
+def render_merged(snapshots):
+    """
+    /metrics по всем воркерам. snapshots — [(жив ли процесс, snapshot()), ...].
+    Счётчики и гистограммы складываются по всем снимкам, включая завершившиеся воркеры,
+    иначе после перезапуска воркера счётчик уменьшился бы; gauge — только по живым.
+    """
+    lines = []
+    for metric in REGISTRY:
+        dumps = [
+            snap.get(metric.name, ()) for alive, snap in snapshots
+            if alive or metric.kind != "gauge"
+        ]
+        lines.extend(metric.render(metric.merge(dumps)))
+    return "\n".join(lines) + "\n"
+
+
+# --------------------
+# метрики сервиса
+# --------------------
+REQUESTS = Counter("ner_requests_total", "HTTP-запросы по эндпоинтам и статусам", ("endpoint", "status"))
+REQUEST_LATENCY = Histogram("ner_request_seconds", "Время обработки HTTP-запроса", ("endpoint",))
+ERRORS = Counter("ner_errors_total", "Ошибки по стадиям", ("stage",))
+IN_FLIGHT = Gauge("ner_requests_in_flight", "Активные HTTP-запросы")
+
+STAGE_LATENCY = Histogram(
+    "ner_stage_seconds",
+    "Время стадий: queue_wait, tokenize, pack, inference (session.run), postprocess",
+    ("stage",),
+)
+BATCH_ROWS = Histogram("ner_batch_rows", "Строк в пачке", buckets=BATCH_ROWS_BUCKETS)
+BATCH_TOKENS = Histogram(
+    "ner_batch_tokens", "Токенов в пачке с паддингом (строки × длина)", buckets=BATCH_TOKENS_BUCKETS
+)
+
+# допуск в очередь и классы приоритета; глубину по классам main задаёт через LANE_QUEUE_DEPTH.fn
+ADMISSION = Counter(
+    "ner_admission_total",
+    "Запросы вне нормального пути: degraded, rejected, timeout, expired (строка выброшена до session.run)",
+    ("result",),
+)
+LANE_LATENCY = Histogram("ner_lane_request_seconds", "Время ответа по классам приоритета", ("lane",))
+LANE_QUEUE_WAIT = Histogram(
+    "ner_lane_queue_wait_seconds", "Ожидание строки в очереди по классам приоритета", ("lane",)
+)
+LANE_QUEUE_DEPTH = Gauge("ner_lane_queue_depth", "Строк в очереди по классам приоритета", ("lane",))
+SUPERSEDED = Counter(
+    "ner_superseded_total",
+    "Вытеснение по сессии: request — запрос отвечен 409, dropped — строка убрана из очереди",
+    ("result",),
+)
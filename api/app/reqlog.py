@@ -0,0 +1,89 @@
+import json
+import queue
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import Counter, Gauge
+
+# --- логи запросов вне event loop ---
+# запись в файл делает фоновый поток QueueListener, в потоке запроса —
+# только проверка семплирования и put_nowait в ограниченную очередь
+
+LOG_RECORDS = Counter(
+    "ner_log_records_total", "Записи лога запросов: queued, dropped, sampled_out", ("result",)
+)
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Одна компактная JSON-строка на запись; msg — словарь полей."""
+
+    def format(self, record):
+        fields = {"ts": round(record.created, 3), "level": record.levelname}
+        if isinstance(record.msg, dict):
+            fields.update(record.msg)
+        else:
+            fields["msg"] = record.getMessage()
+        return json.dumps(fields, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполненной очереди теряет запись и считает это."""
+
+    def prepare(self, record):
+        # форматирование — в потоке записи, здесь запись передаётся как есть
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.labels("queued").inc()
+        except queue.Full:
+            LOG_RECORDS.labels("dropped").inc()
+
+
+def is_slow(record):
+    return getattr(record, "slow", False)
+
+
+class RequestLog:
+    """
+    Лог запросов; медленные запросы (log_slow) пишутся без семплирования
+    тем же потоком — в slow_path, если он задан, иначе в общий файл.
+    """
+
+    def __init__(self, path, sample_rate=1.0, queue_size=10000, slow_path=None):
+        self.sample_rate = sample_rate
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.logger = logging.getLogger("ner.requests")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(DroppingQueueHandler(self.queue))
+
+        file_handler = logging.FileHandler(path, encoding="utf-8")
+        file_handler.setFormatter(JsonLineFormatter())
+        handlers = [file_handler]
+        if slow_path:
+            file_handler.addFilter(lambda record: not is_slow(record))
+            slow_handler = logging.FileHandler(slow_path, encoding="utf-8")
+            slow_handler.setFormatter(JsonLineFormatter())
+            slow_handler.addFilter(is_slow)
+            handlers.append(slow_handler)
+        self.listener = QueueListener(self.queue, *handlers)
+        Gauge("ner_log_queue_depth", "Записей в очереди лога", fn=self.queue.qsize)
+
+    def start(self):
+        # поток записи запускается в каждом воркере после fork
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+    def log(self, **fields):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            LOG_RECORDS.labels("sampled_out").inc()
+            return
+        self.logger.info(fields)
+
+    def log_slow(self, **fields):
+        self.logger.warning(fields, extra={"slow": True})
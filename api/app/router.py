@@ -0,0 +1,251 @@
+import os
+import bisect
+import asyncio
+
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+
+from .text import canonicalize, key_hash
+from . import metrics
+
+# --- маршрутизатор перед репликами API ---
+# запрос уходит на реплику-владельца канонической формы текста (consistent hashing):
+# горячий запрос кэшируется на одной реплике, а не на всех, и суммарная ёмкость кэша
+# растёт с числом реплик. Запрос с ключом сессии (X-Session-Id или session_id) уходит
+# на реплику-владельца сессии: там новый запрос вытесняет её устаревшие запросы.
+# Запуск: uvicorn app.router:app
+
+REPLICAS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("REPLICAS", "http://qa-api-1:8000,http://qa-api-2:8000,http://qa-api-3:8000").split(",")
+    if url.strip()
+]
+ROUTER_VNODES = int(os.getenv("ROUTER_VNODES", "128"))
+# запросов в работе, после которых реплика считается перегруженной
+REPLICA_MAX_INFLIGHT = int(os.getenv("REPLICA_MAX_INFLIGHT", "64"))
+HEALTH_INTERVAL_S = float(os.getenv("HEALTH_INTERVAL_S", "2"))
+UPSTREAM_TIMEOUT_S = float(os.getenv("UPSTREAM_TIMEOUT_S", "10"))
+UPSTREAM_CONNECTIONS = int(os.getenv("UPSTREAM_CONNECTIONS", "64"))
+
+FORWARD_HEADERS = ("content-type", "x-request-timeout-ms", "x-priority", "x-session-id")
+RETURN_HEADERS = ("content-type", "x-degraded")
+
+ROUTED = metrics.Counter(
+    "ner_router_requests_total",
+    "Запросы к репликам: owner — владельцу ключа, fallback — другой реплике",
+    ("replica", "result"),
+)
+UPSTREAM_ERRORS = metrics.Counter(
+    "ner_router_upstream_errors_total", "Ошибки соединения с репликой", ("replica",)
+)
+
+app = FastAPI()
+client = None
+
+
+def route_key(text):
+    # тот же ключ, что у кэша реплики: prepare_text + canonicalize
+    return canonicalize((text or "").strip().lower())[0] if isinstance(text, str) else ""
+
+
+def session_route_key(request, data):
+    session = request.headers.get("x-session-id")
+    if not session and isinstance(data, dict) and isinstance(data.get("session_id"), str):
+        session = data["session_id"]
+    # префикс не пересекается с каноническими формами текстов
+    return "\x00session:" + session if session else None
+
+
+class Replica:
+    __slots__ = ("url", "healthy", "inflight")
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = False
+        self.inflight = 0
+
+
+class HashRing:
+    """Кольцо consistent hashing: по ROUTER_VNODES точек на реплику."""
+
+    def __init__(self, replicas, vnodes):
+        self.replicas = replicas
+        points = sorted(
+            (key_hash(f"{r.url}#{v}"), i) for i, r in enumerate(replicas) for v in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [replicas[i] for _, i in points]
+
+    def preference(self, key):
+        """Реплики в порядке обхода кольца от хэша ключа; первая — владелец."""
+        start = bisect.bisect(self._hashes, key_hash(key))
+        order = []
+        for j in range(len(self._owners)):
+            replica = self._owners[(start + j) % len(self._owners)]
+            if replica not in order:
+                order.append(replica)
+                if len(order) == len(self.replicas):
+                    break
+        return order
+
+
+ring = HashRing([Replica(url) for url in REPLICAS], ROUTER_VNODES)
+
+
+def choose(key):
+    """
+    Владелец ключа, если он жив и не перегружен; иначе — наименее загруженная живая реплика.
+    Упавший владелец заменяется следующей по кольцу, остальные ключи не переезжают.
+    """
+    order = ring.preference(key)
+    healthy = [r for r in order if r.healthy]
+    if not healthy:
+        raise HTTPException(status_code=503, detail="No ready replicas")
+    replica = healthy[0]
+    if replica.inflight >= REPLICA_MAX_INFLIGHT:
+        replica = min(healthy, key=lambda r: r.inflight)
+    ROUTED.labels(replica.url, "owner" if replica is order[0] else "fallback").inc()
+    return replica
+
+
+async def send(key, request, body, replica=None):
+    """POST на реплику; при обрыве соединения реплика выводится из ротации и запрос повторяется."""
+    headers = {h: request.headers[h] for h in FORWARD_HEADERS if h in request.headers}
+    for _ in range(2):
+        target = replica or choose(key)
+        replica = None
+        target.inflight += 1
+        try:
+            return await client.post(
+                target.url + request.url.path, content=body, headers=headers,
+                params=request.query_params,
+            )
+        except httpx.TransportError:
+            UPSTREAM_ERRORS.labels(target.url).inc()
+            target.healthy = False
+        finally:
+            target.inflight -= 1
+    raise HTTPException(status_code=502, detail="Upstream unavailable")
+
+
+def relay(upstream, content=None):
+    headers = {h: upstream.headers[h] for h in RETURN_HEADERS if h in upstream.headers}
+    return Response(
+        content=upstream.content if content is None else content,
+        status_code=upstream.status_code, headers=headers,
+    )
+
+
+def parse_body(body):
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+
+
+# --------------------
+# проверка реплик
+# --------------------
+async def check(replica):
+    try:
+        r = await client.get(replica.url + "/ready", timeout=min(HEALTH_INTERVAL_S, 2.0))
+        replica.healthy = r.status_code == 200
+    except httpx.HTTPError:
+        replica.healthy = False
+
+
+async def health_loop():
+    while True:
+        await asyncio.sleep(HEALTH_INTERVAL_S)
+        await asyncio.gather(*(check(r) for r in ring.replicas))
+
+
+@app.on_event("startup")
+async def startup():
+    # keep-alive соединения к репликам переиспользуются между запросами
+    global client
+    client = httpx.AsyncClient(
+        timeout=UPSTREAM_TIMEOUT_S,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_CONNECTIONS * len(ring.replicas),
+            max_keepalive_connections=UPSTREAM_CONNECTIONS * len(ring.replicas),
+        ),
+    )
+    await asyncio.gather(*(check(r) for r in ring.replicas))
+    asyncio.create_task(health_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await client.aclose()
+
+
+# --------------------
+# эндпоинты
+# --------------------
+@app.post("/predict")
+async def predict(request: Request):
+    body = await request.body()
+    data = parse_body(body)
+    # нажатия одной сессии — на одну реплику, иначе вытеснять устаревшие запросы некому
+    key = session_route_key(request, data)
+    if key is None:
+        key = route_key(data.get("input")) if isinstance(data, dict) else ""
+    return relay(await send(key, request, body))
+
+
+@app.post("/predict_batch")
+async def predict_batch(request: Request):
+    """Строки пачки раскладываются по владельцам, под-пачки уходят параллельно, ответ собирается в исходном порядке."""
+    body = await request.body()
+    data = parse_body(body)
+    inputs = data.get("inputs") if isinstance(data, dict) else None
+    if not isinstance(inputs, list) or not inputs:
+        # некорректное тело — пусть реплика ответит своей ошибкой валидации
+        return relay(await send("", request, body))
+
+    groups = {}
+    for i, text in enumerate(inputs):
+        key = route_key(text)
+        groups.setdefault(choose(key), []).append((i, key))
+    parts = list(groups.items())
+    responses = await asyncio.gather(*(
+        send(members[0][1], request, orjson.dumps({"inputs": [inputs[i] for i, _ in members]}), replica)
+        for replica, members in parts
+    ))
+
+    results = [None] * len(inputs)
+    for (replica, members), upstream in zip(parts, responses):
+        if upstream.status_code != 200:
+            return relay(upstream)
+        for (i, _), result in zip(members, orjson.loads(upstream.content)):
+            results[i] = result
+    degraded = any("x-degraded" in r.headers for r in responses)
+    return Response(
+        content=orjson.dumps(results), media_type="application/json",
+        headers={"X-Degraded": "1"} if degraded else None,
+    )
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness():
+    if not any(r.healthy for r in ring.replicas):
+        raise HTTPException(status_code=503, detail="No ready replicas")
+    return {"status": "ready"}
+
+
+@app.get("/router/stats")
+async def router_stats():
+    return [{"url": r.url, "healthy": r.healthy, "inflight": r.inflight} for r in ring.replicas]
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
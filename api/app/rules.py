@@ -0,0 +1,157 @@
+import os
+import re
+
+from .text import normalize_yo
+
+# --- правила без модели ---
+# регулярки и единицы повторяют preprocess/tokens.py (контейнер API собирается только из app/)
+MERGED_PERCENT_RE = re.compile(r"^\d+[.,]?\d*%$")
+MERGED_VOLUME_RE = re.compile(r"^\d+[.,]?\d*(л|ml|мл|г|гр|кг)$", re.IGNORECASE)
+NUMBER_RE = re.compile(r"^\d+[.,]?\d*$")
+
+UNITS = {
+    "л","литр","литра","литров",
+    "ml","мл","миллилитр",
+    "г","гр","грамм","грамма","граммов",
+    "кг","килограмм",
+    "%","процент","процентов"
+}
+PERCENT_UNITS = {"%","процент","процентов"}
+VOLUME_UNITS = UNITS - PERCENT_UNITS
+
+
+LETTERS_RE = re.compile(r"[a-zа-яе]", re.IGNORECASE)
+
+
+def load_brands(path):
+    """
+    Бренды из data/brands.txt (`бренд<TAB>частота`) в канонической форме.
+    frozenset строк: проверка «весь запрос — известный бренд» за один lookup.
+    """
+    if not path or not os.path.exists(path):
+        return frozenset()
+    brands = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            brand = line.split("\t", 1)[0].strip()
+            if brand:
+                brands.add(" ".join(normalize_yo(brand.lower()).split()))
+    return frozenset(brands)
+
+
+def word_spans(text):
+    """Слова через пробел и их позиции (text уже канонический: одиночные пробелы)."""
+    spans, pos = [], 0
+    for word in text.split(" "):
+        spans.append((word, pos, pos + len(word)))
+        pos += len(word) + 1
+    return spans
+
+
+def entities(spans, labels):
+    return [
+        {"start_index": start, "end_index": end, "entity": label}
+        for (_, start, end), label in zip(spans, labels)
+    ]
+
+
+class FastLane:
+    """
+    Запросы, которые полностью разбираются правилами, — без очереди и модели:
+    - слитный объём / процент: «500мл», «3.2%»;
+    - число + единица: «1 л», «500 мл», «3 %»;
+    - весь запрос — известный бренд из словаря.
+    Спаны в том же формате, что у модели: одно слово — одна сущность.
+    """
+
+    def __init__(self, brands=frozenset()):
+        self.brands = brands
+
+    def resolve(self, text):
+        """Сущности для канонического запроса или None, если правила не покрывают его целиком."""
+        spans = word_spans(text)
+        words = [w for w, _, _ in spans]
+
+        if len(words) == 1:
+            word = words[0]
+            if MERGED_PERCENT_RE.match(word):
+                return entities(spans, ["B-PERCENT"])
+            if MERGED_VOLUME_RE.match(word):
+                return entities(spans, ["B-VOLUME"])
+
+        if len(words) == 2 and NUMBER_RE.match(words[0]):
+            if words[1] in VOLUME_UNITS:
+                return entities(spans, ["B-VOLUME", "I-VOLUME"])
+            if words[1] in PERCENT_UNITS:
+                return entities(spans, ["B-PERCENT", "I-PERCENT"])
+
+        if text in self.brands:
+            return entities(spans, ["B-BRAND"] + ["I-BRAND"] * (len(words) - 1))
+
+        return None
+
+
+class RuleTagger:
+    """
+    Разметка запроса эвристиками пайплайна подготовки данных — деградированный
+    ответ, когда очередь модели переполнена:
+    - объёмы и проценты как в preprocess.tokens.fix_numbers;
+    - бренды из словаря как в restore_brands (сначала многословные);
+    - остальные слова с буквами — TYPE (B-TYPE, затем I-TYPE), прочее — O.
+    """
+
+    def __init__(self, brands=frozenset()):
+        self.singles = {b for b in brands if " " not in b}
+        # многословные бренды по первому слову, длинные — первыми
+        self.phrases = {}
+        for b in sorted((b for b in brands if " " in b), key=lambda b: -len(b.split())):
+            words = tuple(b.split())
+            self.phrases.setdefault(words[0], []).append(words)
+
+    def tag(self, text):
+        spans = word_spans(text)
+        words = [w for w, _, _ in spans]
+        n = len(words)
+        labels = [None] * n
+
+        # --- объёмы / проценты ---
+        for i, w in enumerate(words):
+            if labels[i] is not None:
+                continue
+            if MERGED_PERCENT_RE.match(w):
+                labels[i] = "B-PERCENT"
+            elif MERGED_VOLUME_RE.match(w):
+                labels[i] = "B-VOLUME"
+            elif NUMBER_RE.match(w) and i + 1 < n and words[i + 1] in VOLUME_UNITS:
+                labels[i], labels[i + 1] = "B-VOLUME", "I-VOLUME"
+            elif NUMBER_RE.match(w) and i + 1 < n and words[i + 1] in PERCENT_UNITS:
+                labels[i], labels[i + 1] = "B-PERCENT", "I-PERCENT"
+
+        # --- бренды ---
+        i = 0
+        while i < n:
+            matched = 0
+            if labels[i] is None:
+                for phrase in self.phrases.get(words[i], ()):
+                    L = len(phrase)
+                    if tuple(words[i:i + L]) == phrase and all(l is None for l in labels[i:i + L]):
+                        matched = L
+                        break
+                if not matched and words[i] in self.singles:
+                    matched = 1
+            if matched:
+                labels[i:i + matched] = ["B-BRAND"] + ["I-BRAND"] * (matched - 1)
+                i += matched
+            else:
+                i += 1
+
+        # --- остальное ---
+        for i, w in enumerate(words):
+            if labels[i] is not None:
+                continue
+            if LETTERS_RE.search(w):
+                labels[i] = "I-TYPE" if i > 0 and labels[i - 1] in ("B-TYPE", "I-TYPE") else "B-TYPE"
+            else:
+                labels[i] = "O"
+
+        return entities(spans, labels)
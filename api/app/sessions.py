@@ -0,0 +1,48 @@
+import os
+import fcntl
+import struct
+
+from .text import key_hash
+from .workers import open_shared
+
+# --- последний запрос сессии, общий для воркеров ---
+# таблица в общей памяти (mmap файла в /dev/shm): слот по хэшу ключа сессии хранит
+# (хэш ключа, номер последнего запроса). Новый запрос увеличивает номер под fcntl-блокировкой
+# слота; ожидающий запрос вытеснен, если в его слоте тот же ключ с другим номером
+
+_SLOT = struct.Struct("<QQ")          # hash, seq
+
+
+class SessionTable:
+    """
+    Номера последних запросов сессий для всех воркеров на хосте.
+
+    - фиксированный размер: nslots слотов, слот выбирается по хэшу ключа;
+    - коллизия (в слоте чужой ключ) не вытесняет запрос — в худшем случае
+      устаревший запрос досчитывается, как без ключа сессии;
+    - чтение без блокировок: хэш и номер — выровненные 8-байтные слова.
+    """
+
+    def __init__(self, path, nslots=65536):
+        self.path = path
+        self.nslots = nslots
+        self._fd, self._mm = open_shared(path, nslots * _SLOT.size)
+
+    def bump(self, session):
+        """Регистрирует новый запрос сессии; возвращает его метку для superseded()."""
+        h = key_hash(session)
+        off = (h % self.nslots) * _SLOT.size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, off, os.SEEK_SET)
+        try:
+            # номер растёт в слоте при любом ключе: метка после коллизии не повторяется
+            seq = _SLOT.unpack_from(self._mm, off)[1] + 1
+            _SLOT.pack_into(self._mm, off, h, seq)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, off, os.SEEK_SET)
+        return off, h, seq
+
+    def superseded(self, token):
+        """True, если после запроса с этой меткой пришёл новый запрос той же сессии."""
+        off, h, seq = token
+        current_h, current_seq = _SLOT.unpack_from(self._mm, off)
+        return current_h == h and current_seq != seq
@@ -0,0 +1,71 @@
+import orjson
+
+from starlette.responses import StreamingResponse
+
+# --- потоковая разметка NDJSON ---
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Ответ, который отдаётся, пока тело запроса ещё читается.
+    StreamingResponse слушает receive() ради http.disconnect и забирал бы чанки тела,
+    поэтому receive здесь не трогаем: разрыв соединения увидит чтение request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_lines(request, max_line):
+    """
+    Строки тела запроса по мере поступления, без чтения всего тела в память.
+    Вместо строки длиннее max_line байт отдаётся None, её байты до следующего
+    перевода строки отбрасываются.
+    """
+    buf = bytearray()
+    skipping = False
+    async for chunk in request.stream():
+        # перевод строки ищется только в новом чанке, накопленный хвост не пересканируется
+        start = 0
+        while (end := chunk.find(b"\n", start)) >= 0:
+            if skipping:
+                skipping = False
+            elif len(buf) + end - start > max_line:
+                yield None
+            else:
+                buf += chunk[start:end]
+                yield bytes(buf).rstrip(b"\r")
+            buf.clear()
+            start = end + 1
+        if not skipping:
+            buf += chunk[start:]
+            if len(buf) > max_line:
+                yield None
+                buf.clear()
+                skipping = True
+    if buf:
+        yield bytes(buf).rstrip(b"\r")
+
+
+def parse_line(line, ndjson):
+    """
+    Текст запроса из строки тела: в NDJSON — JSON-строка или {"input": ...},
+    иначе — сама строка. ValueError при некорректной строке.
+    """
+    text = line.decode("utf-8")
+    if not ndjson:
+        return text
+    if not text.strip():
+        return ""
+    obj = orjson.loads(text)
+    if isinstance(obj, dict):
+        obj = obj.get("input")
+    if not isinstance(obj, str):
+        raise ValueError('expected a JSON string or {"input": "..."}')
+    return obj
+
+
+def ndjson_line(obj):
+    return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
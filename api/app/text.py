@@ -0,0 +1,70 @@
+import hashlib
+
+# --- нормализация запросов ---
+# контейнер API собирается только из app/, поэтому правила повторяют
+# preprocess.utils.normalize_yo из пайплайна подготовки датасета
+
+
+def key_hash(key):
+    """
+    Стабильный 64-битный хэш ключа (канонической формы запроса, ключа сессии): один и тот же
+    во всех воркерах и репликах — hash() рандомизирован в каждом процессе.
+    """
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def normalize_yo(text: str) -> str:
+    """
+    Нормализуем 'ё' → 'е' для унификации (как в preprocess.utils).
+    """
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def canonicalize(text):
+    """
+    Каноническая форма запроса: нижний регистр, схлопнутые пробелы, ё → е.
+
+    Возвращает (canonical, index), где index[i] — позиция i-го символа canonical
+    в исходном тексте, либо None, если позиции совпадают.
+    """
+    text_l = text.lower()
+    if len(text_l) != len(text):
+        # редкие символы, меняющие длину при lower(), — работаем как есть
+        text_l = text
+
+    chars, index = [], []
+    prev_space = True
+    for i, ch in enumerate(text_l):
+        if ch.isspace():
+            if not prev_space:
+                chars.append(" ")
+                index.append(i)
+            prev_space = True
+            continue
+        chars.append(ch)
+        index.append(i)
+        prev_space = False
+    if chars and chars[-1] == " ":
+        chars.pop()
+        index.pop()
+
+    canonical = normalize_yo("".join(chars))
+    if len(index) == len(text):
+        return canonical, None
+    return canonical, index
+
+
+def restore_offsets(entities, index):
+    """Переводит спаны из координат канонической строки в координаты исходной."""
+    if index is None:
+        return entities
+    return [
+        {
+            "start_index": index[e["start_index"]],
+            "end_index": index[e["end_index"] - 1] + 1,
+            "entity": e["entity"],
+        }
+        for e in entities
+    ]
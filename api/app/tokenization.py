@@ -0,0 +1,138 @@
+import numpy as np
+from tokenizers import Tokenizer
+
+# --- быстрый токенизатор без transformers ---
+
+
+class FastTokenizer:
+    """
+    tokenizers.Tokenizer с тем подмножеством интерфейса токенизатора transformers,
+    которое нужно сервису: вызов → {"input_ids", "offset_mapping"} и id спецтокенов.
+    Результат совпадает с AutoTokenizer(use_fast=True): это тот же rust-токенизатор.
+    """
+
+    def __init__(self, tokenizer):
+        self.backend = tokenizer
+        self.backend.no_padding()
+        self.cls_token_id = tokenizer.token_to_id("[CLS]")
+        self.sep_token_id = tokenizer.token_to_id("[SEP]")
+        self.pad_token_id = tokenizer.token_to_id("[PAD]")
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(Tokenizer.from_file(path))
+
+    def __call__(self, texts, truncation=False, max_length=None, add_special_tokens=True,
+                 return_offsets_mapping=True):
+        if truncation:
+            self.backend.enable_truncation(max_length)
+        else:
+            self.backend.no_truncation()
+        encodings = self.backend.encode_batch(texts, add_special_tokens=add_special_tokens)
+        return {
+            "input_ids": [e.ids for e in encodings],
+            "offset_mapping": [e.offsets for e in encodings],
+        }
+
+
+# --- токенизация через кэш слов ---
+
+# строки для сверки с полным токенизатором на старте: пунктуация, цифры, латиница,
+# дефисы, проценты, длинный текст под обрезку
+PARITY_SAMPLES = [
+    "молоко 3.2%",
+    "кока кола 1 л",
+    "вода питьевая 500 мл",
+    "coca-cola zero 0,5л",
+    "сыр (плавленый) 45% «хохланд»",
+    "масло сливочное 82.5 % 180гр",
+    "чай greenfield, 25 пак.",
+    "ёжик в тумане",
+    "x" * 40,
+    " ".join(["йогурт питьевой клубника 2.5%"] * 40),
+]
+
+
+class WordPieceCache:
+    """
+    Токенизация без полного вызова токенизатора на повторяющейся лексике.
+
+    BERT pre-tokenizer сначала режет текст по пробелам, а WordPiece не смотрит на
+    соседние слова, поэтому слово, токенизированное отдельно, даёт те же сабтокены,
+    что и внутри запроса. Кэш: слово → (ids, offsets относительно начала слова);
+    настоящий токенизатор вызывается одной пачкой только для новых слов.
+    Текст должен быть каноническим (text.canonicalize): слова через один пробел.
+    """
+
+    def __init__(self, tokenizer, max_len, maxsize=200_000):
+        self.tokenizer = tokenizer
+        self.max_len = max_len
+        self.maxsize = maxsize
+        self.cls_id = tokenizer.cls_token_id
+        self.sep_id = tokenizer.sep_token_id
+        self._words = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._words)
+
+    def _lookup(self, words):
+        unseen = [w for w in dict.fromkeys(words) if w not in self._words]
+        self.misses += len(unseen)
+        self.hits += len(words) - len(unseen)
+        fresh = {}
+        if unseen:
+            enc = self.tokenizer(unseen, add_special_tokens=False, return_offsets_mapping=True)
+            for w, ids, offsets in zip(unseen, enc["input_ids"], enc["offset_mapping"]):
+                fresh[w] = (
+                    np.asarray(ids, dtype=np.int64),
+                    np.asarray(offsets, dtype=np.int64).reshape(-1, 2),
+                )
+            # кэш полон — новые слова считаем, но не запоминаем
+            room = self.maxsize - len(self._words)
+            if room > 0:
+                self._words.update(fresh if room >= len(fresh) else dict(list(fresh.items())[:room]))
+        return fresh
+
+    def encode(self, texts):
+        """(ids, offsets) по каждому тексту с [CLS]/[SEP] и обрезкой до max_len — как у токенизатора."""
+        split = [t.split(" ") for t in texts]
+        fresh = self._lookup([w for ws in split for w in ws])
+        cached = self._words
+
+        all_ids, all_offsets = [], []
+        limit = self.max_len - 2
+        for text_words in split:
+            ids_parts, off_parts, pos = [], [], 0
+            for w in text_words:
+                ids, offsets = cached.get(w) or fresh[w]
+                ids_parts.append(ids)
+                off_parts.append(offsets + pos)
+                pos += len(w) + 1
+            ids = np.concatenate(ids_parts)[:limit] if ids_parts else np.empty(0, np.int64)
+            offsets = np.concatenate(off_parts)[:limit] if off_parts else np.empty((0, 2), np.int64)
+
+            n = len(ids)
+            row_ids = np.empty(n + 2, dtype=np.int64)
+            row_ids[0], row_ids[1:n + 1], row_ids[n + 1] = self.cls_id, ids, self.sep_id
+            row_offsets = np.zeros((n + 2, 2), dtype=np.int64)
+            row_offsets[1:n + 1] = offsets
+            all_ids.append(row_ids)
+            all_offsets.append(row_offsets)
+        return all_ids, all_offsets
+
+    def verify_parity(self, texts=PARITY_SAMPLES):
+        """
+        Сверка с полным токенизатором. Возвращает тексты, на которых результат
+        расходится; пустой список — кэшу можно доверять.
+        """
+        ids, offsets = self.encode(texts)
+        ref = self.tokenizer(
+            texts, truncation=True, max_length=self.max_len, return_offsets_mapping=True
+        )
+        mismatches = []
+        for t, i, o, ref_i, ref_o in zip(texts, ids, offsets, ref["input_ids"], ref["offset_mapping"]):
+            if i.tolist() != list(ref_i) or o.tolist() != [list(x) for x in ref_o]:
+                mismatches.append(t)
+        return mismatches
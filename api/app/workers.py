@@ -0,0 +1,85 @@
+import os
+import mmap
+import fcntl
+
+import orjson
+
+# --- общее состояние воркеров gunicorn ---
+# каждый воркер пишет свой снимок (<pid>.json) в каталог на tmpfs, любой воркер читает все:
+# /metrics и /ready отвечают за весь контейнер, а не за воркер, которому достался запрос
+
+
+class WorkerState:
+    """
+    Снимки состояния воркеров в каталоге `path` (по умолчанию в /dev/shm).
+    Файл подменяется атомарно (запись рядом + os.replace), читатель не видит его недописанным.
+    Снимки завершившихся воркеров остаются до reset(): их счётчики входят в суммы.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def reset(self):
+        """Удаляет снимки прошлого запуска; вызывается в master до fork."""
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+    def publish(self, state):
+        os.makedirs(self.path, exist_ok=True)
+        pid = os.getpid()
+        tmp = os.path.join(self.path, f".{pid}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(state))
+        os.replace(tmp, os.path.join(self.path, f"{pid}.json"))
+
+    def read(self):
+        """[(pid, жив ли процесс, состояние), ...] по всем снимкам каталога."""
+        out = []
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return out
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            pid = int(name[:-5])
+            try:
+                with open(os.path.join(self.path, name), "rb") as f:
+                    state = orjson.loads(f.read())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                continue
+            out.append((pid, pid_alive(pid), state))
+        return out
+
+
+def open_shared(path, size, valid=None, init=None):
+    """
+    Файл общей памяти размером size (обычно в /dev/shm), отображённый в память: (fd, mmap).
+    Под блокировкой всего файла: если размер другой или valid(fd) ложно, файл обнуляется
+    и размечается init(mm) — одновременно стартующие воркеры не размечают его дважды.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.lockf(fd, fcntl.LOCK_EX)
+    try:
+        if os.fstat(fd).st_size != size or (valid is not None and not valid(fd)):
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+            if init is not None:
+                init(mm)
+        else:
+            mm = mmap.mmap(fd, size)
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+    return fd, mm
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,50 @@
+"""
+Сравнение сериализации ответа /predict и /predict_batch:
+прежний путь FastAPI (jsonable_encoder + JSONResponse), ORJSONResponse и format=compact.
+
+    python bench_serialize.py
+"""
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from app.inference import LABELS, compact
+
+N = 20000
+
+
+def sample(n_entities):
+    # типичная разметка: «молоко простоквашино 3.2% 930 мл» и длиннее
+    return [
+        {"start_index": 6 * i, "end_index": 6 * i + 5, "entity": LABELS[1 + i % 8]}
+        for i in range(n_entities)
+    ]
+
+
+def bench(fn, payload, n):
+    fn(payload)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(payload)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+CASES = {
+    "fastapi (jsonable_encoder)": lambda x: JSONResponse(jsonable_encoder(x)).body,
+    "orjson": lambda x: ORJSONResponse(x).body,
+    "orjson + compact": lambda x: ORJSONResponse(
+        [compact(e) for e in x] if x and isinstance(x[0], list) else compact(x)
+    ).body,
+}
+
+if __name__ == "__main__":
+    payloads = {
+        "/predict, 5 сущностей": sample(5),
+        "/predict_batch, 256 × 5": [sample(5)] * 256,
+    }
+    for title, payload in payloads.items():
+        n = N if not isinstance(payload[0], list) else N // 100
+        print(title)
+        for name, fn in CASES.items():
+            print(f"  {name:28s} {bench(fn, payload, n):9.1f} мкс  {len(fn(payload)):7d} байт")
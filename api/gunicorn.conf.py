@@ -0,0 +1,52 @@
+import gc
+import os
+import time
+import signal
+import threading
+
+# --- gunicorn ---
+# модель и токенизатор загружаются один раз в master (preload_app),
+# воркеры получают их через fork и создают только свои сессии ORT
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WORKERS", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+
+
+def on_starting(server):
+    # снимки метрик и готовности воркеров прошлого запуска не должны попасть в /metrics и /ready
+    from app.workers import WorkerState
+    WorkerState(os.getenv("WORKER_STATE_DIR", "/dev/shm/ner-workers")).reset()
+
+
+def when_ready(server):
+    # объекты, загруженные в master, больше не трогаем сборщиком мусора,
+    # иначе страницы с ними копируются в каждом воркере
+    gc.freeze()
+    if server.cfg.preload_app and server.cfg.workers > 1:
+        from app import main
+        # снимок master: его счётчики (перезагрузки модели) входят в /metrics один раз,
+        # воркеры после fork свои обнуляют
+        main.publish_state()
+        if main.MODEL_WATCH_S > 0:
+            # за файлом модели следит master: изменение — тот же SIGHUP, что шлёт /admin/reload
+            threading.Thread(target=watch_model, args=(server, main), daemon=True).start()
+
+
+def on_reload(server):
+    # SIGHUP: при preload_app новые воркеры форкаются из master без повторного импорта приложения,
+    # поэтому модель перечитывается здесь, до fork, — веса снова общие для всех воркеров
+    if server.cfg.preload_app:
+        from app import main
+        main.reload_shared_model()
+        gc.freeze()
+
+
+def watch_model(server, main):
+    seen = main.model_mtime()
+    while True:
+        time.sleep(main.MODEL_WATCH_S)
+        mtime = main.model_mtime()
+        if mtime is not None and mtime != seen:
+            seen = mtime
+            os.kill(server.pid, signal.SIGHUP)
@@ -0,0 +1,57 @@
+import os
+import asyncio
+import tempfile
+
+import orjson
+import pytest
+
+# --- /predict_stream при ошибке модели ---
+# сервис импортируется целиком: нужна модель (MODEL_PATH) и tokenizer.json рядом с ней
+
+MODEL_PATH = os.getenv("MODEL_PATH", "/model/model.onnx")
+if not os.path.exists(MODEL_PATH):
+    pytest.skip(f"нет модели {MODEL_PATH}", allow_module_level=True)
+
+httpx = pytest.importorskip("httpx")
+
+LOG_DIR = tempfile.mkdtemp()
+os.environ.setdefault("LOG_FILE", os.path.join(LOG_DIR, "requests.log"))
+os.environ.setdefault("SLOW_LOG_FILE", os.path.join(LOG_DIR, "slow_requests.log"))
+os.environ.setdefault("WARMUP", "0")
+os.environ.setdefault("STREAM_CHUNK", "2")
+
+from app import main  # noqa: E402
+
+
+async def post_stream(body):
+    """Ответ /predict_stream при модели, которая падает на каждой пачке (run_batch с ошибкой)."""
+    predict_rows = main.predict_rows
+
+    def failing_predict_rows(*args, **kwargs):
+        raise RuntimeError("session lost")
+
+    main.predict_rows = failing_predict_rows
+    try:
+        await main.startup()
+        while not main.ready:
+            await asyncio.sleep(0.01)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.post("/predict_stream", content=body.encode())
+        await main.shutdown()
+    finally:
+        main.predict_rows = predict_rows
+    return r.status_code, [orjson.loads(line) for line in r.text.splitlines()]
+
+
+def test_failed_chunks_report_errors_and_stream_completes():
+    # пачки по 2 строки; пустая строка до модели не доходит, длинная — своя ошибка
+    lines = ["кефир", "сыр", "молоко", "", "x" * (main.STREAM_MAX_LINE_BYTES + 1), "вода"]
+    status, out = asyncio.run(post_stream("\n".join(lines) + "\n"))
+
+    assert status == 200
+    assert len(out) == len(lines)
+    for n in (1, 2, 3, 6):
+        assert out[n - 1] == {"error": "Inference failed: session lost", "line": n}
+    assert out[3] == {"entities": []}
+    assert out[4]["line"] == 5 and out[4]["error"].startswith("Line too long")
@@ -0,0 +1,97 @@
+import csv
+import os
+from pathlib import Path
+
+import pytest
+from tokenizers import Tokenizer
+
+from app.text import canonicalize
+from app.tokenization import FastTokenizer, WordPieceCache
+
+transformers = pytest.importorskip("transformers")
+
+# --- WordPieceCache против полного токенизатора ---
+# кэш слов должен давать те же input_ids и offsets, что AutoTokenizer на всём запросе
+
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "DeepPavlov/rubert-base-cased")
+TRAIN_CSV = Path(__file__).resolve().parents[2] / "data" / "train.csv"
+MAX_LEN = 500
+
+EDGE_CASES = [
+    # пунктуация вплотную к словам и отдельно
+    "молоко 3.2%",
+    "coca-cola zero 0,5л",
+    "сыр (плавленый) 45% «хохланд»",
+    "чай greenfield, 25 пак.",
+    "кефир 1% / 900 г",
+    "вода!!! газ?",
+    "макароны №3 ... 400гр",
+    "масло-сливочное 82,5%-ное",
+    "!!!",
+    # ё — и в исходном виде, и после canonicalize (ё → е)
+    "ёжик в тумане",
+    "мёд гречишный",
+    "ЁЛКА новогодняя",
+    "свёкла ёё",
+    # цифры, дроби, слитно с единицами
+    "0",
+    "1234567890",
+    "вода 0.5 л 1,5л 19л",
+    "2x200мл",
+    "батарейки aa 4шт",
+    "пиво 4.7% 0,45 л 6 шт",
+    # латиница, смешение алфавитов, длинное слово
+    "ipad pro 11",
+    "iphoneчехол",
+    "x" * 40,
+    # длинный текст под обрезку до MAX_LEN токенов
+    " ".join(["йогурт питьевой клубника 2.5%"] * 40),
+]
+
+
+def train_queries():
+    with open(TRAIN_CSV, encoding="utf-8") as f:
+        return [row["sample"] for row in csv.DictReader(f, delimiter=";")]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    try:
+        return transformers.AutoTokenizer.from_pretrained(TOKENIZER_NAME, use_fast=True)
+    except OSError as e:
+        pytest.skip(f"токенизатор {TOKENIZER_NAME} недоступен: {e}")
+
+
+@pytest.fixture(scope="module", params=["auto", "fast"])
+def wordpieces(request, reference):
+    # оба пути сервиса: AutoTokenizer и FastTokenizer из tokenizer.json (копия, чтобы не менять reference)
+    if request.param == "auto":
+        tokenizer = reference
+    else:
+        tokenizer = FastTokenizer(Tokenizer.from_str(reference.backend_tokenizer.to_str()))
+    return WordPieceCache(tokenizer, MAX_LEN)
+
+
+def assert_parity(wordpieces, reference, texts):
+    ids, offsets = wordpieces.encode(texts)
+    ref = reference(texts, truncation=True, max_length=MAX_LEN, return_offsets_mapping=True)
+    for t, i, o, ref_i, ref_o in zip(texts, ids, offsets, ref["input_ids"], ref["offset_mapping"]):
+        assert i.tolist() == list(ref_i), t
+        assert o.tolist() == [list(x) for x in ref_o], t
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+def test_edge_cases(wordpieces, reference, canonical):
+    texts = [" ".join(t.lower().split()) for t in EDGE_CASES]
+    if canonical:
+        texts = [canonicalize(t)[0] for t in texts]
+    assert_parity(wordpieces, reference, texts)
+
+
+@pytest.mark.skipif(not TRAIN_CSV.exists(), reason="нет data/train.csv")
+def test_train_queries(wordpieces, reference):
+    texts = list(dict.fromkeys(canonicalize(q)[0] for q in train_queries()))
+    texts = [t for t in texts if t]
+    # пачками, как в сервисе: кэш слов заполняется по ходу и переиспользуется
+    for start in range(0, len(texts), 256):
+        assert_parity(wordpieces, reference, texts[start:start + 256])
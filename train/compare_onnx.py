@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import onnxruntime as ort
+from datasets import Dataset
+from transformers import AutoTokenizer
+from seqeval.metrics import f1_score
+
+from train import labels, check_and_split, SEED
+
+DATA_FILE = os.environ.get("DATA_FILE", "data/train_bio_final.csv")
+VARIANTS = {"fp32": "model.onnx", "int8": "model_int8.onnx"}
+BATCH_SIZE = 32
+LATENCY_SAMPLES = 300
+
+
+def load_eval_split():
+    """Та же отложенная выборка, что в train.py (test_size=0.1, seed=SEED)."""
+    df = pd.read_csv(DATA_FILE)
+    base = Dataset.from_pandas(df)
+    base = base.map(check_and_split, remove_columns=df.columns.tolist())
+    return base.train_test_split(test_size=0.1, seed=SEED)["test"]
+
+
+def create_session(path):
+    # как в API: один поток на сессию
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = 1
+    so.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+
+
+def run_batch(session, tok, words_batch):
+    enc = tok(
+        words_batch, is_split_into_words=True, truncation=True,
+        max_length=256, padding=True, return_tensors="np"
+    )
+    input_names = {i.name for i in session.get_inputs()}
+    ort_inputs = {k: v for k, v in enc.items() if k in input_names}
+    # сервинговый граф (fuse_outputs.py) сразу отдаёт id меток
+    if "label_ids" in {o.name for o in session.get_outputs()}:
+        return enc, session.run(["label_ids"], ort_inputs)[0]
+    pred = np.argmax(session.run(None, ort_inputs)[0], axis=-1)
+    return enc, pred
+
+
+def evaluate_f1(session, tok, eval_ds):
+    # метка слова — предсказание на первом сабтокене, как в compute_metrics
+    true_tags, pred_tags = [], []
+    for i in range(0, len(eval_ds), BATCH_SIZE):
+        chunk = eval_ds[i:i + BATCH_SIZE]
+        enc, pred = run_batch(session, tok, chunk["tokens"])
+        for b, tags in enumerate(chunk["ner_tags"]):
+            seen, p_line = set(), []
+            for idx, wi in enumerate(enc.word_ids(b)):
+                if wi is None or wi in seen:
+                    continue
+                seen.add(wi)
+                p_line.append(labels[pred[b, idx]])
+            true_tags.append([labels[t] for t in tags[:len(p_line)]])
+            pred_tags.append(p_line)
+    return f1_score(true_tags, pred_tags, average="macro")
+
+
+def measure_speed(session, tok, eval_ds):
+    queries = eval_ds["tokens"]
+    # латентность одиночного запроса
+    latencies = []
+    for words in queries[:LATENCY_SAMPLES]:
+        t0 = time.perf_counter()
+        run_batch(session, tok, [words])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    # пропускная способность пачками
+    t0 = time.perf_counter()
+    for i in range(0, len(queries), BATCH_SIZE):
+        run_batch(session, tok, queries[i:i + BATCH_SIZE])
+    qps = len(queries) / (time.perf_counter() - t0)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), qps
+
+
+def compare(onnx_path, report_file=None):
+    tok = AutoTokenizer.from_pretrained(onnx_path)
+    eval_ds = load_eval_split()
+
+    results = {}
+    for name, fname in VARIANTS.items():
+        path = os.path.join(onnx_path, fname)
+        if not os.path.exists(path):
+            continue
+        session = create_session(path)
+        f1 = evaluate_f1(session, tok, eval_ds)
+        p50, p99, qps = measure_speed(session, tok, eval_ds)
+        size_mb = os.path.getsize(path) / 2**20
+        results[name] = (f1, p50, p99, qps, size_mb)
+
+    lines = [
+        f"=== FP32 vs INT8 (eval: {len(eval_ds)} запросов, 1 поток) ===",
+        f"{'variant':<8}{'f1_macro':>10}{'p50 ms':>10}{'p99 ms':>10}{'qps':>10}{'size MB':>10}",
+    ]
+    for name, (f1, p50, p99, qps, size_mb) in results.items():
+        lines.append(f"{name:<8}{f1:>10.4f}{p50:>10.2f}{p99:>10.2f}{qps:>10.1f}{size_mb:>10.1f}")
+    if "fp32" in results and "int8" in results:
+        fp, q = results["fp32"], results["int8"]
+        lines.append(
+            f"int8/fp32: ΔF1 = {q[0] - fp[0]:+.4f}, "
+            f"ускорение p50 ×{fp[1] / q[1]:.2f}, пропускная способность ×{q[3] / fp[3]:.2f}"
+        )
+    report = "\n".join(lines)
+    print(report)
+    if report_file:
+        with open(report_file, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    compare(sys.argv[1] if len(sys.argv) > 1 else "onxx_name")
@@ -1,6 +1,16 @@
+import os
+
 from optimum.exporters.onnx import main_export
+from onnxruntime.quantization import quantize_dynamic, QuantType
 from transformers import AutoTokenizer
 
+from compare_onnx import compare
+from fuse_outputs import fuse_outputs
+
+# FUSE_ARGMAX=1 — модели отдают id меток вместо логитов (argmax в графе), FUSE_CONFIDENCE=1 — ещё и уверенность
+FUSE_ARGMAX = os.environ.get("FUSE_ARGMAX", "0") == "1"
+FUSE_CONFIDENCE = os.environ.get("FUSE_CONFIDENCE", "0") == "1"
+
 model_path = "model"
 onnx_path = "onxx_name"
 
@@ -17,3 +27,20 @@ main_export(
 AutoTokenizer.from_pretrained(model_path).save_pretrained(onnx_path)
 
 print("Экспорт через main_export завершён.")
+
+# INT8: динамическая квантизация весов (активации квантуются на лету)
+fp32_path = os.path.join(onnx_path, "model.onnx")
+int8_path = os.path.join(onnx_path, "model_int8.onnx")
+quantize_dynamic(
+    model_input=fp32_path,
+    model_output=int8_path,
+    weight_type=QuantType.QInt8,
+)
+print(f"INT8-модель сохранена в {int8_path}")
+
+if FUSE_ARGMAX:
+    for path in (fp32_path, int8_path):
+        fuse_outputs(path, confidence=FUSE_CONFIDENCE)
+
+# Сравнение FP32 и INT8: F1 на отложенной выборке и скорость на CPU
+compare(onnx_path, report_file=os.path.join(onnx_path, "compare_report.txt"))
@@ -0,0 +1,40 @@
+import sys
+
+import onnx
+from onnx import TensorProto, helper
+
+# --- сервинговый граф: argmax по меткам внутри ONNX ---
+# вместо логитов batch × seq × 9 (float) граф отдаёт id меток batch × seq (int64)
+# и, по желанию, уверенность — максимум softmax по меткам
+
+
+def fuse_outputs(path, output_path=None, confidence=False):
+    model = onnx.load(path)
+    graph = model.graph
+    logits = graph.output[0]
+    dims = [d.dim_param or d.dim_value for d in logits.type.tensor_type.shape.dim[:2]]
+
+    nodes = [helper.make_node("ArgMax", [logits.name], ["label_ids"], axis=-1, keepdims=0)]
+    outputs = [helper.make_tensor_value_info("label_ids", TensorProto.INT64, dims)]
+    if confidence:
+        opset = next(o.version for o in model.opset_import if o.domain in ("", "ai.onnx"))
+        nodes.append(helper.make_node("Softmax", [logits.name], ["label_probs"], axis=-1))
+        if opset >= 18:
+            # с opset 18 оси ReduceMax — вход, а не атрибут
+            graph.initializer.append(helper.make_tensor("reduce_axes", TensorProto.INT64, [1], [-1]))
+            nodes.append(helper.make_node("ReduceMax", ["label_probs", "reduce_axes"], ["confidence"], keepdims=0))
+        else:
+            nodes.append(helper.make_node("ReduceMax", ["label_probs"], ["confidence"], axes=[-1], keepdims=0))
+        outputs.append(helper.make_tensor_value_info("confidence", TensorProto.FLOAT, dims))
+
+    graph.node.extend(nodes)
+    del graph.output[:]
+    graph.output.extend(outputs)
+    onnx.checker.check_model(model)
+    onnx.save(model, output_path or path)
+    print(f"Сервинговый граф (label_ids{', confidence' if confidence else ''}) сохранён в {output_path or path}")
+
+
+if __name__ == "__main__":
+    # python fuse_outputs.py onxx_name/model.onnx [--confidence]
+    fuse_outputs(sys.argv[1], confidence="--confidence" in sys.argv[2:])